@@ -0,0 +1,360 @@
+"""a file that defines the benchmark cases, each case is a zero-argument callable plus
+how many contracts/rows one call processes (used for ops/sec)"""
+
+from typing import Callable, List, NamedTuple
+
+import numpy as np
+
+from main.implied_vol import implied_volatility
+from main.logic import (pnl, pnl_grid, price_chain, price_option,
+                        price_options_batch)
+from main.lattice import price_american
+from main.monte_carlo import price_monte_carlo
+from main.pde import price_pde
+from main.portfolio import Portfolio
+
+ENTRY_INPUTS = {
+    "StockPrice": 100.0,
+    "StrikePrice": 100.0,
+    "TimeToExpiry": 1.0,
+    "RiskFreeRate": 0.05,
+    "Volatility": 0.25,
+}
+
+CURRENT_INPUTS = dict(ENTRY_INPUTS, StockPrice=105.0, Volatility=0.3)
+
+HEATMAP_RESOLUTIONS = (10, 20, 50, 200)
+
+
+class Case(NamedTuple):
+    name: str
+    func: Callable[[], object]
+    items: int = 1
+
+
+def _axes(resolution: int):
+    spot_range = np.linspace(70.0, 130.0, resolution)
+    vol_range = np.linspace(0.125, 0.375, resolution)
+    return spot_range, vol_range
+
+
+def _loop_heatmap(resolution: int):
+    """the pre-grid-engine heatmap, one pnl() call per cell & option type"""
+    spot_range, vol_range = _axes(resolution)
+
+    def run():
+        for option_type in ("call", "put"):
+            for vol in vol_range:
+                for spot in spot_range:
+                    current = dict(ENTRY_INPUTS, StockPrice=spot, Volatility=vol)
+                    pnl(current, ENTRY_INPUTS)[f"{option_type}_pnl"]
+
+    return run
+
+
+def pricing_cases() -> List[Case]:
+    cases = [
+        Case("price_option[full]", lambda: price_option(ENTRY_INPUTS)),
+        Case("price_option[prices]", lambda: price_option(ENTRY_INPUTS, "prices")),
+        Case("pnl", lambda: pnl(CURRENT_INPUTS, ENTRY_INPUTS)),
+        Case("pnl_heatmap_loop[10x10]", _loop_heatmap(10), 2 * 10 * 10),
+    ]
+
+    # pnl_grid is what main.ui.cached_pnl_grid runs on a cold miss, importing the ui
+    # module would start streamlit
+    for resolution in HEATMAP_RESOLUTIONS:
+        spot_range, vol_range = _axes(resolution)
+        cases.append(
+            Case(
+                f"pnl_heatmap[{resolution}x{resolution}]",
+                lambda s=spot_range, v=vol_range: pnl_grid(ENTRY_INPUTS, s, v),
+                2 * resolution * resolution,
+            )
+        )
+
+    # the ui's partial recompute: the spot axis of a 200x200 grid extended by 10
+    # steps, only the new columns are priced
+    from main.scenario_grid import IncrementalPnlGrid
+
+    base_spots, base_vols = _axes(200)
+    step = base_spots[1] - base_spots[0]
+    extended = np.append(base_spots, base_spots[-1] + step * np.arange(1, 11))
+    base = pnl_grid(ENTRY_INPUTS, base_spots, base_vols)
+
+    def extend():
+        grid = IncrementalPnlGrid()
+        grid.remember(ENTRY_INPUTS, base_spots, base_vols, base)
+        grid.update(ENTRY_INPUTS, extended, base_vols)
+
+    cases.append(Case("pnl_heatmap_extend[200->210x200]", extend, 2 * 210 * 200))
+
+    rng = np.random.default_rng(0)
+    n = 100_000
+    batch = {
+        "StockPrice": rng.uniform(50.0, 150.0, n),
+        "StrikePrice": 100.0,
+        "TimeToExpiry": rng.uniform(0.05, 2.0, n),
+        "RiskFreeRate": 0.03,
+        "Volatility": rng.uniform(0.1, 0.6, n),
+    }
+    cases.append(Case(f"price_options_batch[{n}]", lambda: price_options_batch(batch), n))
+    cases.append(
+        Case(
+            f"price_options_batch[{n},prices]",
+            lambda: price_options_batch(batch, "prices"),
+            n,
+        )
+    )
+
+    strikes = np.linspace(60.0, 140.0, 200)
+    expiries = np.linspace(0.05, 2.0, 10)
+    surface = 0.2 + 0.3 * ((strikes[:, None] - 100.0) / 100.0) ** 2 + 0.01 * expiries
+    cases.append(
+        Case(
+            "price_chain[200x10]",
+            lambda: price_chain(100.0, strikes, expiries, surface, 0.03),
+            strikes.size * expiries.size,
+        )
+    )
+
+    chain_strikes = np.linspace(60.0, 160.0, 1000)
+    chain_vols = 0.2 + 0.3 * ((chain_strikes - 100.0) / 100.0) ** 2
+    chain = {
+        "StockPrice": 100.0,
+        "StrikePrice": chain_strikes,
+        "TimeToExpiry": 0.5,
+        "RiskFreeRate": 0.03,
+    }
+    is_call = chain_strikes >= 100.0
+    quotes = price_options_batch(dict(chain, Volatility=chain_vols), "prices")
+    quotes = np.where(is_call, quotes["call_price"], quotes["put_price"])
+    cases.append(
+        Case(
+            "implied_volatility[1000]",
+            lambda: implied_volatility(quotes, chain, is_call),
+            chain_strikes.size,
+        )
+    )
+
+    american_put = dict(ENTRY_INPUTS, StockPrice=95.0)
+    for method in ("binomial", "trinomial"):
+        cases.append(
+            Case(
+                f"price_american[{method},100]",
+                lambda m=method: price_american(american_put, steps=100, method=m),
+            )
+        )
+    american_book = {
+        key: value[:10_000] if np.ndim(value) else value for key, value in batch.items()
+    }
+    cases.append(
+        Case(
+            "price_american[binomial,100,10000]",
+            lambda: price_american(american_book, steps=100),
+            10_000,
+        )
+    )
+
+    # one crank-nicolson solve prices the whole spot axis, items are spots
+    pde_spots, _ = _axes(200)
+    pde_axis = dict(ENTRY_INPUTS, StockPrice=pde_spots)
+    for american in (False, True):
+        style = "american" if american else "european"
+        cases.append(
+            Case(
+                f"price_pde[{style},200 spots]",
+                lambda a=american: price_pde(pde_axis, american=a),
+                pde_spots.size,
+            )
+        )
+    spot_range, vol_range = _axes(50)
+    cases.append(
+        Case(
+            "pnl_heatmap_pde[50x50]",
+            lambda: pnl_grid(ENTRY_INPUTS, spot_range, vol_range, pricer=price_pde),
+            2 * 50 * 50,
+        )
+    )
+
+    # seeded so every run simulates the same paths, items are paths
+    for payoff, barrier in (
+        ("european", None),
+        ("asian_arithmetic", None),
+        ("up_and_out", 120.0),
+        ("lookback_floating", None),
+    ):
+        paths = 1_000_000 if payoff == "european" else 50_000
+        cases.append(
+            Case(
+                f"monte_carlo[{payoff},{paths}]",
+                lambda p=payoff, b=barrier, n=paths: price_monte_carlo(
+                    ENTRY_INPUTS, p, paths=n, steps=252, barrier=b, seed=0
+                ),
+                paths,
+            )
+        )
+
+    # a 10k position book over 5 names, the old way was one pnl() call per position
+    book_size = 10_000
+    names = np.array(["AAPL", "MSFT", "SPY", "QQQ", "TSLA"])
+    book = Portfolio(
+        names[rng.integers(0, names.size, book_size)],
+        rng.random(book_size) < 0.5,
+        rng.integers(-10, 11, book_size),
+        rng.uniform(50.0, 150.0, book_size),
+        rng.choice([0.1, 0.25, 0.5, 1.0, 2.0], book_size),
+        rng.uniform(1.0, 20.0, book_size),
+    )
+    market = {
+        "StockPrice": dict(zip(names, (90.0, 110.0, 100.0, 95.0, 120.0))),
+        "Volatility": rng.uniform(0.15, 0.6, book_size),
+        "RiskFreeRate": 0.04,
+    }
+    cases.append(
+        Case(f"portfolio_revalue[{book_size}]", lambda: book.revalue(market), book_size)
+    )
+    cases.append(
+        Case(
+            f"portfolio_net_greeks[{book_size}]",
+            lambda: book.net_greeks(market),
+            book_size,
+        )
+    )
+    shocks = np.linspace(-0.2, 0.2, 20)
+    cases.append(
+        Case(
+            f"portfolio_pnl_grid[{book_size},20x20]",
+            lambda: book.pnl_grid(market, shocks, shocks / 2),
+            book_size * shocks.size * shocks.size,
+        )
+    )
+
+    return cases
+
+
+def rendering_cases(resolutions=(10, 20, 200, 1000)) -> List[Case]:
+    """uncached renders time matplotlib itself, the cached case is the hash & lookup
+    a streamlit rerun pays when the grid didn't change"""
+    from main.heatmap import _render, render_pnl_heatmap
+
+    cases = []
+    for resolution in resolutions:
+        spot_range, vol_range = _axes(resolution)
+        matrix = pnl_grid(ENTRY_INPUTS, spot_range, vol_range)["call_pnl"]
+        annotate = resolution <= 20
+        cases.append(
+            Case(
+                f"render_heatmap[{resolution}x{resolution}]",
+                lambda m=matrix, s=spot_range, v=vol_range, a=annotate: _render(
+                    m, s, v, "CALL PnL Heatmap", a
+                ),
+                resolution * resolution,
+            )
+        )
+        cases.append(
+            Case(
+                f"render_heatmap[{resolution}x{resolution},cached]",
+                lambda m=matrix, s=spot_range, v=vol_range: render_pnl_heatmap(
+                    m, s, v, "CALL PnL Heatmap"
+                ),
+                resolution * resolution,
+            )
+        )
+    return cases
+
+
+def repository_cases(resolution: int = 20) -> List[Case]:
+    """round trips through the real repositories against the sqlite stand-in,
+    the stand-in must already be installed (see standin_db.install_standin)"""
+    from db.repositories.grid_repo import OutputGridRepository
+    from db.repositories.input_repo import InputRepository
+    from db.repositories.output_repo import OutputRepository
+    from main.logic import pnl_grid
+
+    input_repo = InputRepository()
+    output_repo = OutputRepository()
+    grid_repo = OutputGridRepository()
+
+    spot_range, vol_range = _axes(resolution)
+
+    def grid_rows(calculation_id):
+        return [
+            {
+                "CalculationId": calculation_id,
+                "VolatilityShock": float(vol),
+                "StockPriceShock": float(spot),
+                "OptionPrice": 1.0,
+                "IsCall": is_call,
+            }
+            for vol in vol_range
+            for spot in spot_range
+            for is_call in (1, 0)
+        ]
+
+    # reads hit a calculation the write case never grows
+    read_id = input_repo.create_input(ENTRY_INPUTS)
+    output_repo.create_outputs_batch(read_id, grid_rows(read_id))
+    write_id = input_repo.create_input(ENTRY_INPUTS)
+    write_rows = grid_rows(write_id)
+
+    # 200x200 scenario grid through the numpy bulk path, calls then puts
+    bulk_spots, bulk_vols = np.meshgrid(*_axes(200))
+    bulk_size = 2 * bulk_spots.size
+    bulk_columns = (
+        np.tile(bulk_vols.ravel(), 2),
+        np.tile(bulk_spots.ravel(), 2),
+        np.ones(bulk_size),
+        np.repeat([1, 0], bulk_spots.size),
+    )
+
+    # same 200x200 grid as one compressed blob row, each save needs a fresh id
+    grid = pnl_grid(ENTRY_INPUTS, *_axes(200))
+    grid_read_id = input_repo.create_input(ENTRY_INPUTS)
+    grid_repo.save_grid(grid_read_id, *_axes(200), grid["call_pnl"], grid["put_pnl"])
+
+    def save_grid():
+        calculation_id = input_repo.create_input(ENTRY_INPUTS)
+        grid_repo.save_grid(calculation_id, *_axes(200), grid["call_pnl"], grid["put_pnl"])
+
+    return [
+        Case("input_repo.create_input", lambda: input_repo.create_input(ENTRY_INPUTS)),
+        Case("input_repo.list_recent_inputs", lambda: input_repo.list_recent_inputs(5)),
+        Case(
+            f"output_repo.create_outputs_batch[{len(write_rows)}]",
+            lambda: output_repo.create_outputs_batch(write_id, write_rows),
+            len(write_rows),
+        ),
+        Case(
+            f"output_repo.create_outputs_bulk[{bulk_size}]",
+            lambda: output_repo.create_outputs_bulk(write_id, *bulk_columns),
+            bulk_size,
+        ),
+        Case(
+            f"output_repo.get_outputs_by_input[{len(write_rows)}]",
+            lambda: output_repo.get_outputs_by_input(read_id),
+            len(write_rows),
+        ),
+        Case(
+            f"output_repo.iter_outputs[{len(write_rows)}]",
+            lambda: sum(len(batch) for batch in output_repo.iter_outputs([read_id], 200)),
+            len(write_rows),
+        ),
+        Case(
+            f"output_repo.aggregate_outputs[{len(write_rows)}]",
+            lambda: output_repo.aggregate_outputs(
+                [read_id], stats=("min", "max", "avg", "std")
+            ),
+            len(write_rows),
+        ),
+        Case(
+            f"output_repo.output_histogram[{len(write_rows)}]",
+            lambda: output_repo.output_histogram([read_id], bins=20),
+            len(write_rows),
+        ),
+        Case("grid_repo.save_grid[200x200]", save_grid, bulk_size),
+        Case(
+            "grid_repo.get_grid[200x200]",
+            lambda: grid_repo.get_grid(grid_read_id),
+            bulk_size,
+        ),
+    ]
@@ -0,0 +1,311 @@
+"""a file that checks the query plan of every repository query against the configured
+database (EXPLAIN on mysql, EXPLAIN QUERY PLAN on the sqlite backend), the queries are
+captured by calling each repository method against a recording cursor, then explained
+for real, exits 1 when one falls back to a full scan
+
+usage: python -m benchmarks.query_plans [--seed 200] [--verbose]
+       DB_BACKEND=sqlite DB_SQLITE_PATH=plans.db python -m benchmarks.query_plans
+"""
+
+import argparse
+import inspect
+import sys
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Tuple
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).parent.parent))
+from benchmarks.standin_db import install_standin, restore
+from db.repositories.base_repo import BaseRepository
+from db.repositories.grid_repo import OutputGridRepository
+from db.repositories.input_repo import InputRepository
+from db.repositories.output_repo import OutputRepository
+from logger import get_logger
+
+logger = get_logger(__file__)
+
+SAMPLE_INPUTS = {
+    "StockPrice": 100.0,
+    "StrikePrice": 100.0,
+    "TimeToExpiry": 1.0,
+    "RiskFreeRate": 0.05,
+    "Volatility": 0.25,
+}
+
+
+# stands in for a calculation id (never a real one), swapped for a seeded id
+# before explaining
+CALCULATION_ID = -1
+
+
+class Call(NamedTuple):
+    repository: type
+    method: str
+    args: Tuple = ()
+    # unfiltered reads are scans by design
+    allow_scan: bool = False
+
+
+# every public read/update/delete path, inserts have no plan worth checking
+CALLS = (
+    Call(InputRepository, "find_by_id", (CALCULATION_ID,)),
+    Call(InputRepository, "find_all", (50,), allow_scan=True),
+    Call(InputRepository, "update", (CALCULATION_ID, {"Volatility": 0.3})),
+    Call(InputRepository, "delete_by_id", (CALCULATION_ID,)),
+    Call(InputRepository, "list_recent_inputs", (5,)),
+    Call(InputRepository, "find_inputs_by_time_to_expiry", (1.0,)),
+    Call(InputRepository, "find_inputs_by_vol_range", (0.3, 0.2)),
+    Call(OutputRepository, "get_one_row_by_input", (CALCULATION_ID,)),
+    Call(OutputRepository, "get_outputs_by_input", (CALCULATION_ID,)),
+    Call(OutputRepository, "get_outputs_by_scenario", (CALCULATION_ID, 0.25, 100.0)),
+    Call(OutputRepository, "get_call_or_put_outputs", (CALCULATION_ID, 1)),
+    Call(OutputRepository, "delete_outputs_by_input", (CALCULATION_ID,)),
+    Call(OutputRepository, "get_outputs_stats", (CALCULATION_ID, "OptionPrice")),
+    Call(OutputRepository, "aggregate_outputs", ([CALCULATION_ID],)),
+    Call(
+        OutputRepository,
+        "output_histogram",
+        ([CALCULATION_ID], "OptionPrice", 10, (0.0, 50.0)),
+    ),
+    # keyset pages of one calculation seek idx_bs_outputs_calcid, which innodb
+    # extends with the primary key, so ORDER BY pk LIMIT reads no more than a page
+    Call(OutputRepository, "iter_outputs", ([CALCULATION_ID],)),
+    # a later keyset page, seeks past the last primary key seen
+    Call(InputRepository, "iter_rows", (None, "", (), 100, "keyset", CALCULATION_ID)),
+    Call(
+        InputRepository, "iter_batches", (None, "", (), 100, "keyset", CALCULATION_ID)
+    ),
+    Call(OutputGridRepository, "get_grid", (CALCULATION_ID,)),
+)
+
+WRITE_ONLY = {
+    "create",
+    "create_input",
+    "create_outputs_batch",
+    "create_outputs_bulk",
+    "save_grid",
+}
+
+
+class _RecordingCursor:
+    def __init__(self, queries: List):
+        self._queries = queries
+        self.lastrowid = 0
+        self.rowcount = 0
+        self.description = ()
+
+    def execute(self, query, params=()):
+        self._queries.append((" ".join(query.split()), tuple(params)))
+
+    def executemany(self, query, seq_of_params):
+        self._queries.append((" ".join(query.split()), ()))
+
+    def fetchone(self):
+        return None
+
+    def fetchall(self):
+        return []
+
+    def fetchmany(self, size):
+        return []
+
+    def close(self):
+        pass
+
+
+class _Recorder:
+    """get_cursor surface of db.engine.DatabaseConnection that only records queries"""
+
+    def __init__(self):
+        self.queries = []
+
+    @contextmanager
+    def transaction(self):
+        yield None
+
+    @contextmanager
+    def get_connection(self):
+        yield None
+
+    @contextmanager
+    def get_cursor(self, dictionary=False):
+        yield _RecordingCursor(self.queries)
+
+
+def _defined_on(repository: type, name: str) -> type:
+    return next(cls for cls in repository.__mro__ if name in vars(cls))
+
+
+def unchecked_methods() -> List[str]:
+    """public repository methods neither explained nor known to be write only, an
+    inherited BaseRepository method counts once whichever subclass calls it"""
+    covered = {
+        (_defined_on(call.repository, call.method), call.method) for call in CALLS
+    }
+    missing = []
+    for repository in {call.repository for call in CALLS} | {BaseRepository}:
+        for name, member in vars(repository).items():
+            if not inspect.isfunction(member) or name.startswith("_"):
+                continue
+            if name not in WRITE_ONLY and (repository, name) not in covered:
+                missing.append(f"{repository.__name__}.{name}")
+    return sorted(missing)
+
+
+def capture_queries() -> List[Tuple[Call, str, Tuple]]:
+    recorder = _Recorder()
+    previous = install_standin(recorder)
+    captured = []
+    try:
+        for call in CALLS:
+            start = len(recorder.queries)
+            result = getattr(call.repository(), call.method)(*call.args)
+            if inspect.isgenerator(result):
+                list(result)
+            for query, params in recorder.queries[start:]:
+                captured.append((call, query, params))
+    finally:
+        restore(previous)
+    return captured
+
+
+def full_scans(plan: List[Dict], query: str) -> List[str]:
+    """table accesses that read every row, an index walk only passes when the query
+    stops early at a LIMIT without sorting"""
+    problems = []
+    for row in plan:
+        access = row.get("type")
+        extra = row.get("Extra") or ""
+        if access == "ALL":
+            problems.append(f"full table scan of {row['table']}")
+        elif access == "index" and ("LIMIT" not in query or "filesort" in extra):
+            problems.append(f"full index scan of {row['table']} ({row['key']})")
+        elif "Using filesort" in extra and "LIMIT" in query:
+            problems.append(f"{row['table']} sorted in full before the LIMIT")
+    return problems
+
+
+def sqlite_full_scans(plan: List[Dict], query: str) -> List[str]:
+    """the same rules on EXPLAIN QUERY PLAN details: SCAN without an index reads
+    every row, SCAN USING INDEX walks a whole index & only passes when a LIMIT
+    stops it early without a temp b-tree sort"""
+    problems = []
+    details = [row["detail"] for row in plan]
+    sorted_in_full = any(detail.startswith("USE TEMP B-TREE") for detail in details)
+    for detail in details:
+        if not detail.startswith("SCAN "):
+            continue
+        table = detail.split()[1]
+        if "INDEX" not in detail:
+            problems.append(f"full table scan of {table}")
+        elif "LIMIT" not in query or sorted_in_full:
+            problems.append(f"full index scan of {table} ({detail.split()[-1]})")
+    if sorted_in_full and "LIMIT" in query:
+        problems.append("sorted in full before the LIMIT")
+    return problems
+
+
+@contextmanager
+def seeded(calculations: int, grid_points: int = 20):
+    """insert synthetic calculations & refresh index statistics so the optimizer
+    plans for a realistic table rather than an empty one, removed afterwards"""
+    from db.engine import database
+
+    ids = []
+    spot, vol = np.meshgrid(
+        np.linspace(70, 130, grid_points), np.linspace(0.1, 0.5, grid_points)
+    )
+    inputs, outputs = InputRepository(), OutputRepository()
+    try:
+        for i in range(calculations):
+            # spread expiries & vols so the filters on them are selective
+            calculation_id = inputs.create_input(
+                dict(
+                    SAMPLE_INPUTS,
+                    TimeToExpiry=0.1 * (1 + i % 50),
+                    Volatility=0.05 + 0.95 * i / calculations,
+                )
+            )
+            ids.append(calculation_id)
+            outputs.create_outputs_bulk(
+                calculation_id,
+                np.tile(vol.ravel(), 2),
+                np.tile(spot.ravel(), 2),
+                np.zeros(2 * spot.size),
+                np.repeat([1, 0], spot.size),
+            )
+        with database.get_cursor() as cursor:
+            if database.dialect == "sqlite":
+                cursor.execute("ANALYZE")
+            else:
+                cursor.execute(f"ANALYZE TABLE {inputs.table}, {outputs.table}")
+                cursor.fetchall()
+        yield ids
+    finally:
+        for calculation_id in ids:
+            inputs.delete_by_id(calculation_id)
+
+
+def explain(captured, seed_ids: List[int], verbose: bool = False) -> List[str]:
+    from db.engine import database
+
+    sqlite = database.dialect == "sqlite"
+    failures = []
+    for call, query, params in captured:
+        calculation_id = seed_ids[0] if seed_ids else 1
+        params = tuple(
+            calculation_id if value == CALCULATION_ID else value for value in params
+        )
+        # both only plan UPDATE/DELETE, nothing is modified
+        explain_sql = "EXPLAIN QUERY PLAN " if sqlite else "EXPLAIN "
+        with database.get_cursor(dictionary=True) as cursor:
+            cursor.execute(explain_sql + query, params)
+            plan = cursor.fetchall()
+
+        name = f"{call.repository.__name__}.{call.method}"
+        if verbose:
+            for row in plan:
+                if sqlite:
+                    print(f"{name:<45} {row['detail']}")
+                else:
+                    print(
+                        f"{name:<45} {row.get('table')!s:<28} {row.get('type')!s:<7} "
+                        f"{row.get('key')!s:<32} {row.get('Extra') or ''}"
+                    )
+        if call.allow_scan:
+            continue
+        check = sqlite_full_scans if sqlite else full_scans
+        failures.extend(f"{name}: {problem}" for problem in check(plan, query))
+    return failures
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=200,
+        help="synthetic calculations inserted (& removed) before explaining, 0 for none",
+    )
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    failures = [f"{name}: no query plan check" for name in unchecked_methods()]
+    captured = capture_queries()
+
+    if args.seed:
+        with seeded(args.seed) as ids:
+            failures += explain(captured, ids, args.verbose)
+    else:
+        failures += explain(captured, [], args.verbose)
+
+    for failure in failures:
+        logger.error("query plan check failed: %s", failure)
+    print(f"{len(captured)} queries explained, {len(failures)} problem(s)")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
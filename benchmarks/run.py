@@ -0,0 +1,174 @@
+"""a file that runs the benchmark suite, writes machine-readable results & fails when
+a case regresses against the stored baseline or there is no baseline to compare with
+
+usage: python -m benchmarks.run [--output results.json] [--threshold 15]
+                                [--save-baseline] [--filter price_option]
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).parent.parent))
+from benchmarks.cases import (Case, pricing_cases, rendering_cases,
+                              repository_cases)
+from benchmarks.standin_db import SQLiteStandIn, install_standin, restore
+from logger import get_logger
+
+logger = get_logger(__file__)
+
+BASELINE_PATH = Path(__file__).parent / "baseline.json"
+
+
+def measure(case: Case, min_time: float = 0.5, min_calls: int = 5) -> Dict:
+    case.func()  # warm up caches, imports & any jit
+
+    samples = []
+    deadline = time.perf_counter() + min_time
+    while len(samples) < min_calls or time.perf_counter() < deadline:
+        start = time.perf_counter_ns()
+        case.func()
+        samples.append(time.perf_counter_ns() - start)
+
+    # separate call, tracemalloc slows everything it watches
+    tracemalloc.start()
+    case.func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies = np.asarray(samples, dtype=np.float64) / 1e9
+    return {
+        "name": case.name,
+        "calls": len(samples),
+        "items_per_call": case.items,
+        "ops_per_sec": case.items / latencies.mean(),
+        "p50_ms": float(np.percentile(latencies, 50) * 1e3),
+        "p99_ms": float(np.percentile(latencies, 99) * 1e3),
+        "peak_memory_kb": peak / 1024,
+    }
+
+
+def collect_cases(include_db: bool = True) -> List[Case]:
+    cases = pricing_cases()
+    try:
+        cases += rendering_cases()
+    except ImportError as e:
+        logger.warning("skipping heatmap rendering benchmarks: %s", e)
+    if include_db:
+        try:
+            cases += repository_cases()
+        except Exception as e:
+            # the repositories import db.engine, which needs its driver & config
+            logger.warning("skipping repository benchmarks: %s", e)
+    return cases
+
+
+def compare(results: List[Dict], baseline: Dict, threshold_pct: float) -> List[str]:
+    """names & numbers of every case whose ops/sec dropped more than threshold_pct"""
+    regressions = []
+    for result in results:
+        reference = baseline.get(result["name"])
+        if reference is None:
+            continue
+        change = (result["ops_per_sec"] / reference["ops_per_sec"] - 1.0) * 100
+        result["change_pct"] = change
+        if change < -threshold_pct:
+            regressions.append(
+                f"{result['name']}: {result['ops_per_sec']:,.0f} ops/s vs baseline "
+                f"{reference['ops_per_sec']:,.0f} ({change:+.1f}%)"
+            )
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="option pricing benchmarks")
+    parser.add_argument("--output", type=Path, help="write json results here")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=15.0,
+        help="max allowed ops/sec drop vs baseline, in percent",
+    )
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--filter", default="", help="only run cases containing this")
+    parser.add_argument("--min-time", type=float, default=0.5)
+    parser.add_argument("--no-db", action="store_true", help="skip repository cases")
+    parser.add_argument(
+        "--sqlite-path",
+        default=":memory:",
+        help="database file for the repository cases, to include WAL & fsync costs",
+    )
+    args = parser.parse_args(argv)
+
+    standin = None
+    previous = {}
+    if not args.no_db:
+        standin = SQLiteStandIn(args.sqlite_path)
+        try:
+            previous = install_standin(standin)
+        except Exception as e:
+            logger.warning("repository stand-in unavailable: %s", e)
+            standin = None
+
+    try:
+        cases = [
+            case
+            for case in collect_cases(include_db=standin is not None)
+            if args.filter in case.name
+        ]
+        results = []
+        for case in cases:
+            result = measure(case, min_time=args.min_time)
+            results.append(result)
+            print(
+                f"{result['name']:<45} {result['ops_per_sec']:>14,.0f} ops/s "
+                f"p50 {result['p50_ms']:9.3f} ms  p99 {result['p99_ms']:9.3f} ms  "
+                f"peak {result['peak_memory_kb']:10.1f} KiB"
+            )
+    finally:
+        restore(previous)
+
+    # without a baseline the gate would pass whatever the numbers, so that fails too
+    regressions = []
+    no_baseline = not args.save_baseline and not args.baseline.exists()
+    if no_baseline:
+        logger.error(
+            "no baseline at %s, record one with --save-baseline", args.baseline
+        )
+    elif not args.save_baseline:
+        baseline = json.loads(args.baseline.read_text())["results"]
+        regressions = compare(results, baseline, args.threshold)
+        for result in results:
+            if result["name"] not in baseline:
+                logger.warning("%s has no baseline entry yet", result["name"])
+
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "numpy": np.__version__,
+        "threshold_pct": args.threshold,
+        "results": {result["name"]: result for result in results},
+        "regressions": regressions,
+    }
+
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(report, indent=2))
+        print(f"baseline written to {args.baseline}")
+
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    return 1 if regressions or no_baseline else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,40 @@
+"""a file with an in-memory sqlite stand-in for db.engine.database, lets the
+benchmarks exercise the repositories without a mysql server"""
+
+from db.migrate import run_migration
+from db.sqlite_engine import SQLiteDatabase
+
+REPOSITORY_MODULES = (
+    "db.repositories.base_repo",
+    "db.repositories.grid_repo",
+    "db.repositories.input_repo",
+    "db.repositories.output_repo",
+)
+
+
+class SQLiteStandIn(SQLiteDatabase):
+    """the embedded sqlite backend with the schema built from db/migrations"""
+
+    def __init__(self, path: str = ":memory:"):
+        super().__init__(path)
+        run_migration(target=self)
+
+
+def install_standin(standin: SQLiteStandIn):
+    """point every repository module at the stand-in, returns the replaced objects
+    so the caller can restore them"""
+    import importlib
+
+    previous = {}
+    for name in REPOSITORY_MODULES:
+        module = importlib.import_module(name)
+        previous[name] = module.database
+        module.database = standin
+    return previous
+
+
+def restore(previous):
+    import importlib
+
+    for name, database in previous.items():
+        importlib.import_module(name).database = database
@@ -0,0 +1,188 @@
+"""a file that measures cold-start import cost with python -X importtime, each target is
+imported in a fresh interpreter and checked against its time budget & the modules it
+must never load
+
+usage: python -m benchmarks.startup [--output startup.json] [--repeat 5]
+                                    [--budget-scale 1.5] [--top 10]
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Tuple
+
+sys.path.append(str(Path(__file__).parent.parent))
+from logger import get_logger
+
+logger = get_logger(__file__)
+
+ROOT = Path(__file__).parent.parent
+
+# modules the pricing-only path must never pull in
+PLOTTING_AND_DB = ("matplotlib", "seaborn", "pandas", "streamlit", "mysql", "db")
+
+
+class Target(NamedTuple):
+    module: str
+    budget_ms: float
+    forbidden: Tuple[str, ...] = ()
+    # a streamlit script runs its whole page on import, with streamlit stubbed out
+    # the first st.* call stops it so only the module's own imports are timed
+    stub_streamlit: bool = False
+
+
+TARGETS = (
+    Target("main.logic", 150.0, PLOTTING_AND_DB + ("scipy",)),
+    Target("main.implied_vol", 150.0, PLOTTING_AND_DB + ("scipy",)),
+    Target("main.writer", 175.0, PLOTTING_AND_DB),
+    Target("db.engine", 300.0, ("matplotlib", "seaborn", "streamlit", "main")),
+    # plotting, scipy & db load on first use inside the page, never at import
+    Target(
+        "main.ui",
+        200.0,
+        ("matplotlib", "seaborn", "pandas", "scipy", "mysql", "db"),
+        stub_streamlit=True,
+    ),
+)
+
+_STREAMLIT_STUB = """
+import types
+
+
+def _stop(*args, **kwargs):
+    raise ScriptStopped
+
+
+streamlit = types.ModuleType("streamlit")
+streamlit.__getattr__ = lambda name: _stop
+sys.modules["streamlit"] = streamlit
+"""
+
+_PROBE = """
+import json, sys
+
+
+class ScriptStopped(BaseException):
+    pass
+
+{stub}
+try:
+    import {module}
+except ScriptStopped:
+    pass
+print(json.dumps(sorted(sys.modules)))
+"""
+
+
+def parse_importtime(stderr: str) -> Dict[str, Tuple[int, int]]:
+    """module -> (self us, cumulative us) from the -X importtime report"""
+    timings = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        timings[name.strip()] = (int(self_us), int(cumulative_us))
+    return timings
+
+
+def measure_target(target: Target, repeat: int = 5, top: int = 10) -> Dict:
+    """best of `repeat` fresh interpreters, the first run also warms the bytecode cache"""
+    best = None
+    for _ in range(repeat + 1):
+        proc = subprocess.run(
+            [
+                sys.executable,
+                "-X",
+                "importtime",
+                "-c",
+                _PROBE.format(
+                    module=target.module,
+                    stub=_STREAMLIT_STUB if target.stub_streamlit else "",
+                ),
+            ],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=False,
+        )
+        if proc.returncode != 0:
+            raise RuntimeError(f"importing {target.module} failed:\n{proc.stderr}")
+
+        timings = parse_importtime(proc.stderr)
+        if best is None or timings[target.module][1] < best[0][target.module][1]:
+            best = timings, json.loads(proc.stdout.splitlines()[-1])
+
+    timings, modules = best
+    loaded = [
+        name
+        for name in target.forbidden
+        if any(module == name or module.startswith(name + ".") for module in modules)
+    ]
+    slowest = sorted(timings.items(), key=lambda item: item[1][0], reverse=True)[:top]
+    return {
+        "module": target.module,
+        "import_ms": timings[target.module][1] / 1e3,
+        "budget_ms": target.budget_ms,
+        "modules_loaded": len(modules),
+        "forbidden_loaded": loaded,
+        "slowest_self_ms": {name: self_us / 1e3 for name, (self_us, _) in slowest},
+    }
+
+
+def check(results: List[Dict], budget_scale: float = 1.0) -> List[str]:
+    failures = []
+    for result in results:
+        budget = result["budget_ms"] * budget_scale
+        if result["import_ms"] > budget:
+            failures.append(
+                f"{result['module']} imports in {result['import_ms']:.1f} ms, "
+                f"budget {budget:.1f} ms"
+            )
+        if result["forbidden_loaded"]:
+            failures.append(
+                f"{result['module']} loads {', '.join(result['forbidden_loaded'])}"
+            )
+    return failures
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--output", type=Path)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument(
+        "--budget-scale",
+        type=float,
+        default=1.0,
+        help="multiply every budget, for slower ci machines",
+    )
+    parser.add_argument("--filter", default="", help="only run targets containing this")
+    args = parser.parse_args(argv)
+
+    results = []
+    for target in TARGETS:
+        if args.filter not in target.module:
+            continue
+        result = measure_target(target, repeat=args.repeat, top=args.top)
+        results.append(result)
+        print(
+            f"{result['module']:<20} {result['import_ms']:9.1f} ms "
+            f"(budget {result['budget_ms'] * args.budget_scale:.0f} ms) "
+            f"{result['modules_loaded']:5d} modules"
+        )
+        for name, self_ms in result["slowest_self_ms"].items():
+            print(f"    {self_ms:8.1f} ms  {name}")
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+    failures = check(results, args.budget_scale)
+    for failure in failures:
+        logger.error("startup budget exceeded: %s", failure)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
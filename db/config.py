@@ -4,6 +4,9 @@ import os
 from dotenv import load_dotenv
 
 load_dotenv()
+# "mysql" (pooled server) or "sqlite" (embedded, DB_SQLITE_PATH can be :memory:)
+database_backend = os.getenv("DB_BACKEND", "mysql")
+sqlite_path = os.getenv("DB_SQLITE_PATH", "option_pricing.db")
 # default values
 host = os.getenv("DB_HOST")
 port = int(os.getenv("DB_PORT", "3306"))
@@ -12,3 +15,13 @@ password = os.getenv("DB_PASSWORD")
 database = os.getenv("DB_NAME")
 database_pool_size = int(os.getenv("DB_POOL_SIZE", "5"))
 database_pool_name = os.getenv("DB_POOL_NAME")
+# seconds to wait for a free pooled connection before giving up
+database_pool_timeout = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+# extra is_connected() ping (and reconnect) on checkout, off by default since the
+# connector's pool.get_connection() already reconnects a dropped connection, so the
+# ping would only add a server round trip to every checkout
+database_pool_validate = os.getenv("DB_POOL_VALIDATE", "0") == "1"
+# LOAD DATA LOCAL INFILE for OutputRepository.create_outputs_bulk(method="load_data")
+database_local_infile = os.getenv("DB_LOCAL_INFILE", "0") == "1"
+# where save_calculation_to_db writes outputs: "rows", "grid" (one blob per calculation) or "both"
+output_storage = os.getenv("DB_OUTPUT_STORAGE", "rows")
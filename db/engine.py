@@ -1,18 +1,34 @@
 """file that defines pooling, cursor & connection, creates an object that
 will be imported by other files"""
 
+import threading
+import time
 from contextlib import contextmanager
 
 from mysql.connector import Error, pooling
+from mysql.connector.errors import PoolError
 
-from db.config import (database, database_pool_name, database_pool_size, host,
-                       password, port, user)
+from db.config import (database, database_backend, database_local_infile,
+                       database_pool_name, database_pool_size,
+                       database_pool_timeout, database_pool_validate, host,
+                       password, port, sqlite_path, user)
 from logger import get_logger
+from metrics import counter, gauge, histogram
 
 logger = get_logger(__file__)
 
+_checkouts = counter("db_connection_checkouts_total")
+_errors = counter("db_connection_errors_total")
+_exhausted = counter("db_pool_exhausted_total")
+_timeouts = counter("db_pool_checkout_timeouts_total")
+_reconnects = counter("db_pool_reconnects_total")
+_active = gauge("db_pool_active_connections")
+_idle = gauge("db_pool_idle_connections")
+_checkout_seconds = histogram("db_connection_checkout_seconds")
+_held_seconds = histogram("db_connection_held_seconds")
 
-# pool creation (once, at import time)
+
+# pool creation (once, on first use)
 def create_db_pool():
     try:
         return pooling.MySQLConnectionPool(
@@ -23,34 +39,150 @@ def create_db_pool():
             user=user,
             password=password,
             database=database,
+            allow_local_infile=database_local_infile,
         )
     except Error as e:
         logger.error("error creating db pool: %s", e)
         raise
 
 
-_POOL = create_db_pool()
+class DatabaseConnection:
+    """pooled connections with the pool opened lazily on first checkout, so importing
+    the repositories never touches the server. checkouts wait up to checkout_timeout
+    seconds for a free connection and are optionally pinged before use"""
+
+    dialect = "mysql"
 
+    def __init__(
+        self,
+        pool=None,
+        checkout_timeout: float = database_pool_timeout,
+        validate: bool = database_pool_validate,
+    ):
+        self._pool = pool
+        self._slots = None
+        self._pool_lock = threading.Lock()
+        self.checkout_timeout = checkout_timeout
+        self.validate = validate
+        self.active = 0
+        self._local = threading.local()
 
-class DatabaseConnection:
-    def __init__(self, pool):
-        self.pool = pool
+    @property
+    def pool(self):
+        if self._slots is None:
+            with self._pool_lock:
+                if self._slots is None:
+                    if self._pool is None:
+                        self._pool = create_db_pool()
+                    size = getattr(self._pool, "pool_size", database_pool_size)
+                    _idle.set(size)
+                    self._slots = threading.BoundedSemaphore(size)
+        return self._pool
+
+    @property
+    def pool_size(self) -> int:
+        return getattr(self.pool, "pool_size", database_pool_size)
+
+    def stats(self):
+        return {
+            "pool_size": self.pool_size,
+            "active": self.active,
+            "idle": self.pool_size - self.active,
+            "checkouts": _checkouts.value,
+            "exhausted": _exhausted.value,
+            "timeouts": _timeouts.value,
+            "reconnects": _reconnects.value,
+        }
+
+    def _checkout(self):
+        pool = self.pool
+        start = time.perf_counter()
+
+        # the connector's pool fails instantly when empty, the semaphore turns that
+        # into a bounded wait & lets us count how often we ran dry
+        if not self._slots.acquire(blocking=False):
+            _exhausted.inc()
+            if not self._slots.acquire(timeout=self.checkout_timeout):
+                _timeouts.inc()
+                logger.warning(
+                    "no pooled connection free after %ss (pool size %s)",
+                    self.checkout_timeout,
+                    self.pool_size,
+                )
+                raise PoolError(
+                    f"no pooled connection free after {self.checkout_timeout}s"
+                )
+
+        try:
+            conn = pool.get_connection()
+            if self.validate and not conn.is_connected():
+                _reconnects.inc()
+                conn.reconnect(attempts=1)
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._pool_lock:
+            self.active += 1
+            _active.set(self.active)
+            _idle.set(self.pool_size - self.active)
+        _checkout_seconds.observe(time.perf_counter() - start)
+        _checkouts.inc()
+        return conn
+
+    def _checkin(self, conn):
+        try:
+            conn.close()  # hands a pooled connection back to the pool
+        except Error as e:
+            logger.error("error returning connection to pool: %s", e)
+        finally:
+            with self._pool_lock:
+                self.active -= 1
+                _active.set(self.active)
+                _idle.set(self.pool_size - self.active)
+            self._slots.release()
+
+    @contextmanager
+    def transaction(self):
+        """every get_connection/get_cursor made on this thread inside the block
+        shares one connection and commits once at the end"""
+        if getattr(self._local, "conn", None) is not None:
+            yield self._local.conn
+            return
+
+        with self.get_connection() as conn:
+            self._local.conn = conn
+            try:
+                yield conn
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                self._local.conn = None
 
     @contextmanager
     def get_connection(self):
+        shared = getattr(self._local, "conn", None)
+        if shared is not None:
+            yield shared
+            return
+
         conn = None
         try:
-            conn = self.pool.get_connection()
+            conn = self._checkout()
+            checked_out = time.perf_counter()
             yield conn
             conn.commit()
         except Error as e:
+            _errors.inc()
             if conn:
                 conn.rollback()
             logger.error("database error: %s", e)
             raise
         finally:
-            if conn and conn.is_connected():
-                conn.close()
+            if conn:
+                _held_seconds.observe(time.perf_counter() - checked_out)
+                self._checkin(conn)
 
     @contextmanager
     def get_cursor(self, dictionary=False):
@@ -61,6 +193,33 @@ class DatabaseConnection:
             finally:
                 cursor.close()
 
+    @contextmanager
+    def migration_lock(
+        self, name: str = "option_pricing_migrations", timeout: int = 60
+    ):
+        """server-wide advisory lock held on its own pooled connection, so replicas
+        starting together don't apply the same migration twice"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT GET_LOCK(%s, %s)", (name, timeout))
+                (locked,) = cursor.fetchone()
+                if locked != 1:
+                    raise TimeoutError(f"could not acquire migration lock {name}")
+                try:
+                    yield
+                finally:
+                    cursor.execute("SELECT RELEASE_LOCK(%s)", (name,))
+                    cursor.fetchone()
+            finally:
+                cursor.close()
+
+
+# singleton exposed to migrations & repos, DB_BACKEND=sqlite swaps in the embedded
+# backend, the mysql pool itself opens on first use
+if database_backend == "sqlite":
+    from db.sqlite_engine import SQLiteDatabase
 
-# singleton exposed to migrations & repos
-database = DatabaseConnection(_POOL)
+    database = SQLiteDatabase(sqlite_path)
+else:
+    database = DatabaseConnection()
@@ -1,47 +1,195 @@
-"""this file run the sql migrations in db/migrations"""
+"""this file runs the sql migrations in db/migrations, each numbered file is applied once
+and recorded with its checksum in the schema migrations table, so a current schema costs
+one query & an applied file that was edited afterwards is refused"""
+import hashlib
+import re
+import sqlite3
 from pathlib import Path
+from typing import Dict, List, NamedTuple
 
-import mysql.connector
+from mysql.connector import Error, errorcode
 
-from db.config import database, host, password, port, user
+from db.engine import database
 from logger import get_logger
 
 logger = get_logger(__file__)
 
+MIGRATIONS_DIR = Path(__file__).parent / "migrations"
+VERSION_TABLE = "SchemaMigrations"
+VERSION_TABLE_SQL = (
+    f"CREATE TABLE IF NOT EXISTS {VERSION_TABLE} ("
+    "Version INT NOT NULL, "
+    "Name VARCHAR(255) NOT NULL, "
+    "Checksum CHAR(64) NOT NULL, "
+    "applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, "
+    "PRIMARY KEY (Version)"
+    ") ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci"
+)
 
-def run_migration():
-    migrations_dir = Path(__file__).parent / "migrations"
-    sql_file = migrations_dir / "001_input_output_table.sql"
+_FILE_PATTERN = re.compile(r"^(\d{3})_.+\.sql$")
 
-    conn = mysql.connector.connect(
-        host=host,
-        port=port,
-        user=user,
-        password=password,
-        database=database,
-    )
+# mysql has no IF NOT EXISTS / IF EXISTS for indexes, these errors mean an index
+# statement already took effect on an earlier, partially failed run of its file
+_ALREADY_APPLIED = frozenset(
+    (errorcode.ER_DUP_KEYNAME, errorcode.ER_CANT_DROP_FIELD_OR_KEY)
+)
 
-    cursor = conn.cursor()
 
+class Migration(NamedTuple):
+    version: int
+    path: Path
+
+
+def available_migrations(migrations_dir: Path = MIGRATIONS_DIR) -> List[Migration]:
+    migrations = []
+    for path in sorted(migrations_dir.glob("[0-9][0-9][0-9]_*.sql")):
+        match = _FILE_PATTERN.match(path.name)
+        if match:
+            migrations.append(Migration(int(match.group(1)), path))
+
+    versions = [migration.version for migration in migrations]
+    if len(set(versions)) != len(versions):
+        raise ValueError(f"duplicate migration numbers in {migrations_dir}")
+    return migrations
+
+
+def split_statements(sql: str) -> List[str]:
+    """drop -- comment lines and split on ;"""
+    lines = [line for line in sql.splitlines() if not line.lstrip().startswith("--")]
+    statements = (statement.strip() for statement in "\n".join(lines).split(";"))
+    return [statement for statement in statements if statement]
+
+
+def _is_missing_table(error: Exception) -> bool:
+    # mysql reports an errno, sqlite only a message
+    if getattr(error, "errno", None) == errorcode.ER_NO_SUCH_TABLE:
+        return True
+    return isinstance(error, sqlite3.OperationalError) and "no such table" in str(error)
+
+
+def _max_version(cursor) -> int:
     try:
-        with open(sql_file) as f:
-            sql_statements = f.read()
-            for statement in sql_statements.split(";"):
-                statement = statement.strip()
-                if statement:
-                    cursor.execute(statement)
-            logger.info("Completed migration: %s", sql_file.name)
-    except FileNotFoundError as e:
-        logger.error("file not found: %s", e)
-        raise
-    except Exception as e:
-        logger.error("migration error: %s", e)
-        raise
-
-    conn.commit()
-    cursor.close()
-    conn.close()
+        cursor.execute(f"SELECT MAX(Version) FROM {VERSION_TABLE}")
+    except (Error, sqlite3.Error) as e:
+        if not _is_missing_table(e):
+            raise
+        return 0
+    (version,) = cursor.fetchone()
+    return version or 0
+
+
+def current_version(target=None) -> int:
+    """highest applied version, 0 when the version table doesn't exist yet"""
+    with (target or database).get_cursor() as cursor:
+        return _max_version(cursor)
+
+
+def checksum(path: Path) -> str:
+    return hashlib.sha256(path.read_text(encoding="utf-8").encode("utf-8")).hexdigest()
+
+
+def applied_checksums(target=None) -> Dict[int, str]:
+    """version -> recorded checksum of every applied migration, empty when the
+    version table doesn't exist yet"""
+    with (target or database).get_cursor() as cursor:
+        try:
+            cursor.execute(f"SELECT Version, Checksum FROM {VERSION_TABLE}")
+        except (Error, sqlite3.Error) as e:
+            if not _is_missing_table(e):
+                raise
+            return {}
+        return {version: recorded for version, recorded in cursor.fetchall()}
+
+
+def verify_checksums(migrations: List[Migration], applied: Dict[int, str]):
+    """an applied file edited afterwards never runs again, so its change would be
+    silently missing from every existing database"""
+    edited = [
+        migration.path.name
+        for migration in migrations
+        if migration.version in applied
+        and applied[migration.version] != checksum(migration.path)
+    ]
+    if edited:
+        raise ValueError(f"applied migrations were edited: {', '.join(edited)}")
+
+
+def _statements(sql: str, dialect: str) -> List[str]:
+    statements = split_statements(sql)
+    if dialect == "sqlite":
+        from db.sqlite_engine import translate_mysql
+
+        statements = [
+            translated for mysql in statements for translated in translate_mysql(mysql)
+        ]
+    return statements
+
+
+def _execute(cursor, statement: str):
+    try:
+        cursor.execute(statement)
+    except Error as e:
+        if getattr(e, "errno", None) not in _ALREADY_APPLIED:
+            raise
+        logger.info("skipping already applied statement: %s", e)
+
+
+def _apply(target, migration: Migration):
+    sql = migration.path.read_text(encoding="utf-8")
+
+    # mysql commits implicitly around DDL, so there the transaction only makes the
+    # version row & data changes atomic & files should stay re-runnable (IF NOT
+    # EXISTS, one index change per ALTER so _execute can skip the ones already
+    # done), sqlite rolls back the whole file
+    with target.transaction():
+        with target.get_cursor() as cursor:
+            if _max_version(cursor) >= migration.version:
+                return False  # applied by another process meanwhile
+            for statement in _statements(sql, target.dialect):
+                _execute(cursor, statement)
+            cursor.execute(
+                f"INSERT INTO {VERSION_TABLE} (Version, Name, Checksum) "
+                "VALUES (%s, %s, %s)",
+                (migration.version, migration.path.name, checksum(migration.path)),
+            )
+    logger.info("Completed migration: %s", migration.path.name)
+    return True
+
+
+def run_migration(migrations_dir: Path = MIGRATIONS_DIR, target=None) -> List[int]:
+    """apply every migration newer than the recorded version, one transaction per
+    file, returns the applied versions (empty when the schema was already current).
+    target defaults to db.engine.database, whichever backend that is"""
+    target = target or database
+    migrations = available_migrations(migrations_dir)
+    latest = migrations[-1].version if migrations else 0
+
+    # one query either way, it also tells whether the schema is current
+    applied_versions = applied_checksums(target)
+    verify_checksums(migrations, applied_versions)
+    if max(applied_versions, default=0) >= latest:
+        return []
+
+    applied = []
+    with target.migration_lock():
+        try:
+            with target.transaction():
+                with target.get_cursor() as cursor:
+                    for statement in _statements(VERSION_TABLE_SQL, target.dialect):
+                        cursor.execute(statement)
+            for migration in migrations:
+                if _apply(target, migration):
+                    applied.append(migration.version)
+        except Exception as e:
+            logger.error("migration error: %s", e)
+            raise
+
+    return applied
 
 
 if __name__ == "__main__":
-    run_migration()
+    applied = run_migration()
+    if applied:
+        logger.info("applied migrations: %s", applied)
+    else:
+        logger.info("schema is current (version %s)", current_version())
@@ -1,4 +1,4 @@
-"""file that creates mysql tables for our blackscholes inputs & outputs"""
+-- file that creates mysql tables for our blackscholes inputs & outputs
 
 CREATE TABLE IF NOT EXISTS BlackScholesInputs (
     CalculationId INT NOT NULL AUTO_INCREMENT,
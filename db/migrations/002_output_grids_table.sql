@@ -0,0 +1,23 @@
+-- one row per calculation holding the whole scenario grid as a compressed blob,
+-- Payload is zlib over byte-shuffled float64 little-endian values (spot axis, vol axis,
+-- call matrix, put matrix), matrices row-major as (VolPoints, SpotPoints), see Codec
+
+CREATE TABLE IF NOT EXISTS BlackScholesOutputGrids (
+    CalculationId INT NOT NULL,
+
+    SpotPoints INT NOT NULL,
+    VolPoints INT NOT NULL,
+    Codec VARCHAR(16) NOT NULL,
+    Payload LONGBLOB NOT NULL,
+
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+
+    PRIMARY KEY (CalculationId),
+
+    CONSTRAINT FK_BlackScholesInputs_BlackScholesOutputGrids
+        FOREIGN KEY (CalculationId)
+        REFERENCES BlackScholesInputs (CalculationId)
+        ON DELETE CASCADE
+        ON UPDATE NO ACTION
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
@@ -0,0 +1,17 @@
+-- indexes shaped for the repository access paths:
+-- scenario lookups seek on (CalculationId, VolatilityShock, StockPriceShock), the trailing
+-- IsCall & OptionPrice make per-calculation stats covering (no row lookups)
+-- idx_bs_outputs_calcid stays: innodb appends the primary key to it, so it is really
+-- (CalculationId, CalculationOutputId) & serves the keyset pages of iter_outputs
+-- (CalculationId = ? AND pk > ? ORDER BY pk LIMIT n) as one range read, the scenario
+-- index would sort every row of the calculation first
+-- list_recent_inputs reads created_at newest first & stops at the LIMIT
+-- one index per ALTER, mysql commits each one & the runner skips an index that an
+-- earlier, partially failed run already added
+
+ALTER TABLE BlackScholesOutputs
+    ADD INDEX idx_bs_outputs_scenario
+        (CalculationId, VolatilityShock, StockPriceShock, IsCall, OptionPrice);
+
+ALTER TABLE BlackScholesInputs
+    ADD INDEX idx_bs_inputs_created_at (created_at);
@@ -1,6 +1,34 @@
-"""file with base class that has attrs table name & primary key, basic CRUD operations"""
+"""file with base class that has attrs table name & primary key, basic CRUD operations
+& constant memory iterators for exports/backfills"""
+
+import re
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
 
 from db.engine import database
+from metrics import timed, timer
+
+_IDENTIFIER = re.compile(r"^\w+$")
+
+
+def _to_records(rows: List[tuple], names: Sequence[str]) -> np.recarray:
+    """tuple rows -> record array, DECIMAL columns become float64, integers int64,
+    timestamps datetime64[us] & anything else (or a NULL) stays object"""
+    arrays = []
+    for column in zip(*rows):
+        kinds = {type(value) for value in column}
+        if kinds <= {int, bool}:
+            arrays.append(np.array(column, dtype=np.int64))
+        elif kinds <= {int, float, Decimal}:
+            arrays.append(np.array(column, dtype=np.float64))
+        elif kinds <= {datetime}:
+            arrays.append(np.array(column, dtype="datetime64[us]"))
+        else:
+            arrays.append(np.array(column, dtype=object))
+    return np.rec.fromarrays(arrays, names=list(names))
 
 
 class BaseRepository:
@@ -8,6 +36,7 @@ class BaseRepository:
         self.table = table_name
         self.pk = pk_column
 
+    @timed("db_repository_seconds", method="create")
     def create(self, data: dict) -> int:
         if not data:
             raise ValueError("no data provided")
@@ -20,6 +49,7 @@ class BaseRepository:
             cursor.execute(query, tuple(data.values()))
             return cursor.lastrowid
 
+    @timed("db_repository_seconds", method="find_by_id")
     def find_by_id(self, pk_value):
         query = f"SELECT * FROM {self.table} WHERE {self.pk} = %s"
 
@@ -27,6 +57,7 @@ class BaseRepository:
             cursor.execute(query, (pk_value,))
             return cursor.fetchone()
 
+    @timed("db_repository_seconds", method="find_all")
     def find_all(self, limit=50):
         query = f"SELECT * FROM {self.table} LIMIT %s"
 
@@ -34,6 +65,7 @@ class BaseRepository:
             cursor.execute(query, (limit,))
             return cursor.fetchall()
 
+    @timed("db_repository_seconds", method="update")
     def update(self, pk_value, data: dict) -> int:
         if not data:
             return 0
@@ -46,9 +78,134 @@ class BaseRepository:
             cursor.execute(query, values)
             return cursor.rowcount
 
+    @timed("db_repository_seconds", method="delete_by_id")
     def delete_by_id(self, pk_value) -> bool:
         query = f"DELETE FROM {self.table} WHERE {self.pk} = %s"
 
         with database.get_cursor() as cursor:
             cursor.execute(query, (pk_value,))
             return cursor.rowcount > 0
+
+    def _iter_pages(
+        self,
+        columns: Optional[Sequence[str]],
+        where: str,
+        params: Sequence,
+        batch_size: int,
+        method: str,
+        after,
+        dictionary: bool,
+    ) -> Iterator[List]:
+        if batch_size <= 0:
+            raise ValueError("batch_size must be positive")
+        if columns is not None:
+            if not all(_IDENTIFIER.match(column) for column in columns):
+                raise ValueError("invalid column name")
+            # keyset paging resumes from the last primary key, so it is always read
+            columns = list(columns) + ([self.pk] if self.pk not in columns else [])
+        selected = ", ".join(columns) if columns else "*"
+
+        if method == "keyset":
+            yield from self._keyset_pages(
+                selected, where, tuple(params), batch_size, after, dictionary
+            )
+        elif method == "stream":
+            yield from self._streamed_pages(
+                selected, where, tuple(params), batch_size, after, dictionary
+            )
+        else:
+            raise ValueError(f"unknown iteration method: {method}")
+
+    def _keyset_pages(self, selected, where, params, batch_size, after, dictionary):
+        # WHERE pk > last seen ORDER BY pk LIMIT n, every page is an index seek no
+        # matter how deep, unlike OFFSET, & no connection is held between pages
+        pk_index = None
+        while True:
+            conditions = ([f"{self.pk} > %s"] if after is not None else []) + (
+                [f"({where})"] if where else []
+            )
+            query = f"SELECT {selected} FROM {self.table}"
+            if conditions:
+                query += f" WHERE {' AND '.join(conditions)}"
+            query += f" ORDER BY {self.pk} LIMIT %s"
+            page_params = ((after,) if after is not None else ()) + params
+            page_params += (batch_size,)
+
+            with timer("db_repository_seconds", method="iter_page"):
+                with database.get_cursor(dictionary=dictionary) as cursor:
+                    cursor.execute(query, page_params)
+                    rows = cursor.fetchall()
+                    names = [column[0] for column in cursor.description]
+
+            if not rows:
+                return
+            if dictionary:
+                after = rows[-1][self.pk]
+            else:
+                pk_index = names.index(self.pk) if pk_index is None else pk_index
+                after = rows[-1][pk_index]
+            yield rows, names
+            if len(rows) < batch_size:
+                return
+
+    def _streamed_pages(self, selected, where, params, batch_size, after, dictionary):
+        # one unbuffered SELECT read with fetchmany, holds a connection until the
+        # caller is done but never pages through an index again
+        conditions = ([f"{self.pk} > %s"] if after is not None else []) + (
+            [f"({where})"] if where else []
+        )
+        query = f"SELECT {selected} FROM {self.table}"
+        if conditions:
+            query += f" WHERE {' AND '.join(conditions)}"
+        query += f" ORDER BY {self.pk}"
+        params = ((after,) if after is not None else ()) + params
+
+        with database.get_cursor(dictionary=dictionary) as cursor:
+            cursor.execute(query, params)
+            names = [column[0] for column in cursor.description]
+            exhausted = False
+            try:
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        exhausted = True
+                        return
+                    yield rows, names
+            finally:
+                # the server keeps sending the result set, drain it in pages so
+                # the connection can go back to the pool
+                while not exhausted and cursor.fetchmany(batch_size):
+                    pass
+
+    def iter_rows(
+        self,
+        columns: Optional[Sequence[str]] = None,
+        where: str = "",
+        params: Sequence = (),
+        batch_size: int = 1000,
+        method: str = "keyset",
+        after=None,
+    ) -> Iterator[Dict]:
+        """every matching row as a dict in primary key order, batch_size rows in
+        memory at a time. method is "keyset" (one query per page, resumable with
+        after=<last primary key>) or "stream" (one unbuffered query). where is a
+        trusted sql fragment with %s placeholders for params"""
+        for rows, _ in self._iter_pages(
+            columns, where, params, batch_size, method, after, dictionary=True
+        ):
+            yield from rows
+
+    def iter_batches(
+        self,
+        columns: Optional[Sequence[str]] = None,
+        where: str = "",
+        params: Sequence = (),
+        batch_size: int = 10_000,
+        method: str = "keyset",
+        after=None,
+    ) -> Iterator[np.recarray]:
+        """like iter_rows but yields numpy record arrays of up to batch_size rows"""
+        for rows, names in self._iter_pages(
+            columns, where, params, batch_size, method, after, dictionary=False
+        ):
+            yield _to_records(rows, names)
@@ -0,0 +1,118 @@
+"""a file that defines a child class (gridrepo), stores a whole scenario grid per calculation
+as one compressed blob row in the blackscholes output grids table"""
+
+import zlib
+from typing import Dict, Optional
+
+import numpy as np
+
+from db.engine import database
+from db.repositories.base_repo import BaseRepository
+from metrics import timed
+
+GRID_CODEC = "f64le-shuffle-zlib"
+
+
+def encode_grid(
+    spot_axis: np.ndarray,
+    vol_axis: np.ndarray,
+    call_prices: np.ndarray,
+    put_prices: np.ndarray,
+    level: int = 1,
+) -> bytes:
+    """zlib(byte-shuffled float64 little-endian: spot axis, vol axis, call matrix,
+    put matrix), matrices are (len(vol_axis), len(spot_axis)) like
+    main.logic.pnl_grid. shuffling groups the i-th byte of every value together,
+    which is what lets zlib find the repeated sign/exponent bytes"""
+    spot_axis = np.ravel(spot_axis)
+    vol_axis = np.ravel(vol_axis)
+    shape = (vol_axis.size, spot_axis.size)
+
+    call_prices = np.asarray(call_prices)
+    put_prices = np.asarray(put_prices)
+    if call_prices.shape != shape or put_prices.shape != shape:
+        raise ValueError(
+            f"price matrices must be {shape}, "
+            f"got {call_prices.shape} & {put_prices.shape}"
+        )
+
+    flat = np.concatenate(
+        [spot_axis, vol_axis, call_prices.ravel(), put_prices.ravel()]
+    ).astype("<f8")
+    shuffled = flat.view(np.uint8).reshape(-1, 8).T
+    return zlib.compress(shuffled.tobytes(), level)
+
+
+def decode_grid(
+    payload: bytes, spot_points: int, vol_points: int
+) -> Dict[str, np.ndarray]:
+    cells = spot_points * vol_points
+    values = spot_points + vol_points + 2 * cells
+    raw = np.frombuffer(zlib.decompress(payload), dtype=np.uint8)
+    if raw.size != 8 * values:
+        raise ValueError("grid payload does not match its stored dimensions")
+    flat = raw.reshape(8, values).T.copy().view("<f8").ravel()
+
+    shape = (vol_points, spot_points)
+    vol_start = spot_points
+    call_start = vol_start + vol_points
+    put_start = call_start + cells
+    return {
+        "spot_axis": flat[:vol_start],
+        "vol_axis": flat[vol_start:call_start],
+        "call_prices": flat[call_start:put_start].reshape(shape),
+        "put_prices": flat[put_start:].reshape(shape),
+    }
+
+
+class OutputGridRepository(BaseRepository):
+    def __init__(self):
+        super().__init__("BlackScholesOutputGrids", pk_column="CalculationId")
+
+    @timed("db_repository_seconds", method="save_grid")
+    def save_grid(
+        self,
+        calculation_id: int,
+        spot_axis: np.ndarray,
+        vol_axis: np.ndarray,
+        call_prices: np.ndarray,
+        put_prices: np.ndarray,
+    ) -> int:
+        payload = encode_grid(spot_axis, vol_axis, call_prices, put_prices)
+        query = (
+            f"INSERT INTO {self.table} "
+            "(CalculationId, SpotPoints, VolPoints, Codec, Payload) "
+            "VALUES (%s, %s, %s, %s, %s)"
+        )
+
+        with database.get_cursor() as cursor:
+            cursor.execute(
+                query,
+                (
+                    calculation_id,
+                    int(np.size(spot_axis)),
+                    int(np.size(vol_axis)),
+                    GRID_CODEC,
+                    payload,
+                ),
+            )
+            return cursor.rowcount
+
+    @timed("db_repository_seconds", method="get_grid")
+    def get_grid(self, calculation_id: int) -> Optional[Dict[str, np.ndarray]]:
+        query = (
+            f"SELECT SpotPoints, VolPoints, Codec, Payload FROM {self.table} "
+            "WHERE CalculationId = %s"
+        )
+
+        with database.get_cursor() as cursor:
+            cursor.execute(query, (calculation_id,))
+            row = cursor.fetchone()
+
+        if row is None:
+            return None
+
+        spot_points, vol_points, codec, payload = row
+        if codec != GRID_CODEC:
+            raise ValueError(f"unsupported grid codec: {codec}")
+        return decode_grid(bytes(payload), spot_points, vol_points)
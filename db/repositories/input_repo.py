@@ -4,12 +4,14 @@ from typing import Dict
 
 from db.engine import database
 from db.repositories.base_repo import BaseRepository
+from metrics import timed
 
 
 class InputRepository(BaseRepository):
     def __init__(self):
         super().__init__("BlackScholesInputs", pk_column="CalculationId")
 
+    @timed("db_repository_seconds", method="create_input")
     def create_input(self, inputs: Dict[str, float]):
         columns = ", ".join(inputs.keys())
         placeholders = ", ".join(["%s"] * len(inputs))
@@ -19,6 +21,7 @@ class InputRepository(BaseRepository):
             cursor.execute(query, tuple(inputs.values()))
             return cursor.lastrowid
 
+    @timed("db_repository_seconds", method="list_recent_inputs")
     def list_recent_inputs(self, limit: int = 5):
         query = f"SELECT * FROM {self.table} ORDER BY created_at DESC LIMIT %s"
 
@@ -26,6 +29,7 @@ class InputRepository(BaseRepository):
             cursor.execute(query, (limit,))
             return cursor.fetchall()
 
+    @timed("db_repository_seconds", method="find_inputs_by_time_to_expiry")
     def find_inputs_by_time_to_expiry(self, time_to_expiry):
         query = f"SELECT * FROM {self.table} WHERE TimeToExpiry = %s"
 
@@ -33,6 +37,7 @@ class InputRepository(BaseRepository):
             cursor.execute(query, (time_to_expiry,))
             return cursor.fetchall()
 
+    @timed("db_repository_seconds", method="find_inputs_by_vol_range")
     def find_inputs_by_vol_range(self, upper_vol, lower_vol):
         query = f"SELECT * FROM {self.table} WHERE Volatility BETWEEN %s AND %s"
 
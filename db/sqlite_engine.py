@@ -0,0 +1,258 @@
+"""file with the embedded sqlite backend, same transaction/get_connection/get_cursor
+surface as db.engine.DatabaseConnection so the repositories run unchanged on a local
+file or :memory:, plus the translation of the mysql migrations into sqlite ddl"""
+
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List
+
+from logger import get_logger
+
+logger = get_logger(__file__)
+
+# tuned for bulk writes from a single process: WAL lets readers run during a write,
+# NORMAL only syncs at checkpoints (a crash can lose the last commits, never corrupt)
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "temp_store": "MEMORY",
+    "cache_size": -64_000,  # KiB
+    "mmap_size": 256 * 1024 * 1024,
+    "foreign_keys": "ON",
+    "busy_timeout": 5_000,  # ms
+}
+
+_TYPES = (
+    (re.compile(r"\b(?:TINY|SMALL|MEDIUM|BIG)?INT(?:\(\d+\))?", re.I), "INTEGER"),
+    (
+        re.compile(r"\b(?:DECIMAL|NUMERIC)\(\d+,\s*\d+\)|\b(?:DOUBLE|FLOAT)\b", re.I),
+        "REAL",
+    ),
+    (re.compile(r"\b(?:VAR)?CHAR\(\d+\)|\b(?:TINY|MEDIUM|LONG)?TEXT\b", re.I), "TEXT"),
+    (re.compile(r"\b(?:TINY|MEDIUM|LONG)?BLOB\b", re.I), "BLOB"),
+    (re.compile(r"\s+ON UPDATE CURRENT_TIMESTAMP", re.I), ""),
+)
+_CREATE_TABLE = re.compile(
+    r"^CREATE TABLE (IF NOT EXISTS )?(\w+)\s*\((.*)\)[^)]*$", re.I | re.S
+)
+_ALTER_TABLE = re.compile(r"^ALTER TABLE (\w+)\s+(.*)$", re.I | re.S)
+_INDEX = re.compile(
+    r"^(?:ADD\s+)?(UNIQUE\s+)?(?:INDEX|KEY)\s+(\w+)\s*(\(.*\))$", re.I | re.S
+)
+_DROP_INDEX = re.compile(r"^DROP\s+(?:INDEX|KEY)\s+(\w+)$", re.I)
+_TABLE_CONSTRAINTS = ("PRIMARY KEY", "CONSTRAINT", "FOREIGN KEY", "UNIQUE")
+_PRIMARY_KEY = re.compile(r"^PRIMARY KEY\s*\((\w+)\)$", re.I)
+
+
+def _split_top_level(text: str) -> List[str]:
+    """split on commas outside parentheses"""
+    parts, depth, current = [], 0, []
+    for char in text:
+        if char == "," and depth == 0:
+            parts.append("".join(current).strip())
+            current = []
+            continue
+        depth += {"(": 1, ")": -1}.get(char, 0)
+        current.append(char)
+    parts.append("".join(current).strip())
+    return [part for part in parts if part]
+
+
+def _create_index(match, table: str) -> str:
+    unique, name, columns = match.groups()
+    unique = "UNIQUE " if unique else ""
+    return f"CREATE {unique}INDEX IF NOT EXISTS {name} ON {table} {columns}"
+
+
+def _translate_create(match) -> List[str]:
+    if_not_exists, table, body = match.groups()
+    items = _split_top_level(body)
+
+    auto_increment = {
+        item.split()[0] for item in items if "AUTO_INCREMENT" in item.upper()
+    }
+    columns, indexes = [], []
+    for item in items:
+        index = _INDEX.match(item)
+        primary = _PRIMARY_KEY.match(item)
+        if index:
+            indexes.append(_create_index(index, table))
+        elif primary and primary.group(1) in auto_increment:
+            continue  # folded into the column as INTEGER PRIMARY KEY
+        elif item.split()[0] in auto_increment:
+            columns.append(f"{item.split()[0]} INTEGER PRIMARY KEY AUTOINCREMENT")
+        elif item.upper().startswith(_TABLE_CONSTRAINTS):
+            columns.append(item)
+        else:
+            for pattern, replacement in _TYPES:
+                item = pattern.sub(replacement, item)
+            columns.append(item)
+
+    create = (
+        f"CREATE TABLE {if_not_exists or ''}{table} (\n    "
+        + ",\n    ".join(columns)
+        + "\n)"
+    )
+    return [create] + indexes
+
+
+def _translate_alter(match) -> List[str]:
+    table, clauses = match.groups()
+    statements = []
+    for clause in _split_top_level(clauses):
+        index = _INDEX.match(clause)
+        drop = _DROP_INDEX.match(clause)
+        if index:
+            statements.append(_create_index(index, table))
+        elif drop:
+            statements.append(f"DROP INDEX IF EXISTS {drop.group(1)}")
+        else:
+            raise ValueError(f"no sqlite translation for ALTER TABLE clause: {clause}")
+    return statements
+
+
+def translate_mysql(statement: str) -> List[str]:
+    """one mysql migration statement -> the sqlite statements doing the same, covers
+    what db/migrations uses: CREATE TABLE with inline indexes & foreign keys, and
+    ALTER TABLE ADD/DROP INDEX. anything else passes through unchanged"""
+    statement = statement.strip()
+    create = _CREATE_TABLE.match(statement)
+    if create:
+        return _translate_create(create)
+    alter = _ALTER_TABLE.match(statement)
+    if alter:
+        return _translate_alter(alter)
+    return [statement]
+
+
+def _dict_row(cursor, row):
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+class _Cursor:
+    """translates the mysql %s placeholders the repositories use into sqlite ?"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, query, params=()):
+        self._cursor.execute(query.replace("%s", "?"), tuple(params))
+
+    def executemany(self, query, seq_of_params):
+        self._cursor.executemany(query.replace("%s", "?"), seq_of_params)
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchmany(self, size):
+        return self._cursor.fetchmany(size)
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteDatabase:
+    """a file database gets one connection per thread (WAL readers don't block the
+    writer), :memory: is a single connection shared behind a lock since every new
+    connection would be a new empty database. transactions are explicit BEGINs, so
+    ddl is transactional too"""
+
+    dialect = "sqlite"
+
+    def __init__(self, path: str = ":memory:", pragmas: Dict = None):
+        self.path = path
+        self.pragmas = dict(PRAGMAS, **(pragmas or {}))
+        self.in_memory = path == ":memory:" or path.startswith("file::memory:")
+        self._local = threading.local()
+        self._lock = threading.RLock()
+        self._migration_lock = threading.Lock()
+        self._shared = self._connect() if self.in_memory else None
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.path,
+            isolation_level=None,
+            check_same_thread=not self.in_memory,
+            uri=self.path.startswith("file:"),
+        )
+        for name, value in self.pragmas.items():
+            if name == "journal_mode" and self.in_memory:
+                continue  # WAL needs a file, memory databases keep their own journal
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._shared is not None:
+            return self._shared
+        conn = getattr(self._local, "connection", None)
+        if conn is None:
+            conn = self._local.connection = self._connect()
+        return conn
+
+    @contextmanager
+    def _begin(self, mode: str):
+        with self._lock if self.in_memory else nullcontext():
+            conn = self._connection()
+            if conn.in_transaction:
+                yield conn
+                return
+
+            conn.execute(f"BEGIN {mode}")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except BaseException:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+
+    @contextmanager
+    def transaction(self):
+        """IMMEDIATE takes the write lock up front, so two writers can't both read
+        and then fail to upgrade"""
+        with self._begin("IMMEDIATE") as conn:
+            yield conn
+
+    @contextmanager
+    def get_connection(self):
+        with self._begin("DEFERRED") as conn:
+            yield conn
+
+    @contextmanager
+    def get_cursor(self, dictionary=False):
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            if dictionary:
+                cursor.row_factory = _dict_row
+            try:
+                yield _Cursor(cursor)
+            finally:
+                cursor.close()
+
+    @contextmanager
+    def migration_lock(self):
+        # other processes are kept out by the IMMEDIATE transaction each migration
+        # runs in, which re-reads the version first
+        with self._migration_lock:
+            yield
+
+    def stats(self):
+        return {"path": self.path, "dialect": self.dialect, "pragmas": self.pragmas}
+
@@ -1,15 +1,15 @@
 """file dedicated to custom decorators (time, singlton, retry)"""
 
-def timing(func):
+import time
+from functools import wraps
 
-    @wraps(func)
-    def decorator(*args, **kwargs):
-        start = time.perf_counter()
-        result = func(*args, **kwargs)
-        end = time.perf_counter()
-        print(f"{func.__name__} took {(start-end)*1000.:4f} ms to excute")
+from metrics import timed
 
-    return decorator
+
+def timing(func):
+    """records every call's wall time in the metrics registry as
+    function_seconds{function="<qualname>"}"""
+    return timed("function_seconds", function=func.__qualname__)(func)
 
 
 def singleton(cls):
@@ -38,7 +38,7 @@ def retry(max_attempts: int = 4, delay: float = 1.0, backoff_factor: float = 2.0
 
             for attempt in range(1, max_attempts + 1):
                 try:
-                    return func(*args, **kwrags)
+                    return func(*args, **kwargs)
                 except Exception as e:
                     last_exception = (
                         f"{func.__name__} failed after attempt {attempt} due to: {e}"
@@ -1,10 +1,12 @@
 """a file that configures a custom logger for better error output (format, levels..)"""
 
 import logging
+import os
 from logging.handlers import RotatingFileHandler
 from pathlib import Path
 
-log_path = Path(__file__).parent / "logs.log"
+# LOG_FILE moves the log out of the repo root, e.g. for test & benchmark runs
+log_path = Path(os.getenv("LOG_FILE") or Path(__file__).parent / "logs.log")
 log_path.parent.mkdir(
     parents=True, exist_ok=True
 )  # not needed in this simple project at this moment
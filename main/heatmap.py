@@ -0,0 +1,218 @@
+"""a file that renders the pnl heatmaps to png, annotated cells for small grids and a
+plain raster above that, with the rendered images cached by a hash of the grid"""
+
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Optional
+
+import numpy as np
+
+from metrics import counter, timed
+
+# above this many cells per axis the per-cell text is unreadable & dominates render time
+ANNOTATE_MAX_POINTS = 20
+# rasters wider/taller than this are strided down, the figure has fewer pixels anyway
+RASTER_MAX_POINTS = 1000
+
+FIGSIZE = (10, 8)
+DPI = 100
+
+TRADING_COLORS = (
+    "#eb3349",
+    "#f45c43",
+    "#ff9a76",
+    "#ffe5d9",
+    "#d4edda",
+    "#38ef7d",
+    "#11998e",
+)
+
+_hits = counter("heatmap_cache_hits_total")
+_misses = counter("heatmap_cache_misses_total")
+
+
+@lru_cache(maxsize=None)
+def trading_cmap(n_bins: int = 100):
+    from matplotlib.colors import LinearSegmentedColormap
+
+    return LinearSegmentedColormap.from_list("trading", TRADING_COLORS, N=n_bins)
+
+
+def grid_key(
+    pnl_matrix: np.ndarray, spot_range: np.ndarray, vol_range: np.ndarray, title: str
+) -> str:
+    """content hash of everything that changes the picture"""
+    digest = hashlib.blake2b(digest_size=16)
+    for array in (pnl_matrix, spot_range, vol_range):
+        array = np.ascontiguousarray(array, dtype=np.float64)
+        digest.update(str(array.shape).encode())
+        digest.update(array.tobytes())
+    digest.update(title.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _color_limits(pnl_matrix: np.ndarray):
+    # symmetric around zero like seaborn's center=0, so breakeven is always the
+    # middle color
+    extent = float(np.nanmax(np.abs(pnl_matrix))) if pnl_matrix.size else 0.0
+    extent = extent or 1.0
+    return -extent, extent
+
+
+def _draw_annotated(ax, pnl_matrix, spot_range, vol_range, cmap, vmin, vmax):
+    rows, cols = pnl_matrix.shape
+    image = ax.imshow(
+        pnl_matrix,
+        cmap=cmap,
+        vmin=vmin,
+        vmax=vmax,
+        aspect="auto",
+        interpolation="nearest",
+    )
+
+    # white cell borders
+    ax.set_xticks(np.arange(cols + 1) - 0.5, minor=True)
+    ax.set_yticks(np.arange(rows + 1) - 0.5, minor=True)
+    ax.grid(which="minor", color="white", linewidth=0.5)
+    ax.tick_params(which="minor", length=0)
+
+    ax.set_xticks(np.arange(cols))
+    ax.set_xticklabels(np.round(spot_range, 2), rotation=45, ha="right")
+    ax.set_yticks(np.arange(rows))
+    ax.set_yticklabels(np.round(vol_range, 3))
+
+    # dark text on the pale middle of the colormap, white on the saturated ends
+    normalized = (pnl_matrix - vmin) / (vmax - vmin)
+    fontsize = 8 if max(rows, cols) <= 12 else 6
+    for (row, col), value in np.ndenumerate(pnl_matrix):
+        color = "white" if abs(normalized[row, col] - 0.5) > 0.3 else "black"
+        ax.text(
+            col,
+            row,
+            f"{value:.2f}",
+            ha="center",
+            va="center",
+            color=color,
+            fontsize=fontsize,
+        )
+    return image
+
+
+def _draw_raster(ax, pnl_matrix, spot_range, vol_range, cmap, vmin, vmax):
+    row_step = max(1, -(-pnl_matrix.shape[0] // RASTER_MAX_POINTS))
+    col_step = max(1, -(-pnl_matrix.shape[1] // RASTER_MAX_POINTS))
+    # rows run top to bottom from the lowest vol, same orientation as the annotated map
+    return ax.imshow(
+        pnl_matrix[::row_step, ::col_step],
+        cmap=cmap,
+        vmin=vmin,
+        vmax=vmax,
+        aspect="auto",
+        interpolation="nearest",
+        extent=(spot_range[0], spot_range[-1], vol_range[-1], vol_range[0]),
+    )
+
+
+def _render(pnl_matrix, spot_range, vol_range, title, annotate) -> bytes:
+    # Figure without pyplot: nothing registered globally, so nothing to close &
+    # safe from streamlit's script threads
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=FIGSIZE, dpi=DPI)
+    ax = fig.add_subplot()
+    cmap = trading_cmap()
+    vmin, vmax = _color_limits(pnl_matrix)
+
+    draw = _draw_annotated if annotate else _draw_raster
+    image = draw(ax, pnl_matrix, spot_range, vol_range, cmap, vmin, vmax)
+    fig.colorbar(image, ax=ax, label="PnL ($)")
+
+    ax.set_title(title, fontsize=16, fontweight="bold", pad=20)
+    ax.set_xlabel("Spot Price ($)", fontsize=12)
+    ax.set_ylabel("Volatility (σ)", fontsize=12)
+    # fixed margins, tight_layout would lay out (i.e. draw) every cell label twice
+    fig.subplots_adjust(left=0.1, right=0.98, bottom=0.12, top=0.9)
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png")
+    return buffer.getvalue()
+
+
+class HeatmapCache:
+    """LRU of rendered png bytes keyed by grid_key, max_entries bounds memory (a
+    1000x800 heatmap png is ~50-150 KiB)"""
+
+    def __init__(self, max_entries: int = 64):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            png = self._entries.get(key)
+            if png is not None:
+                self._entries.move_to_end(key)
+            return png
+
+    def put(self, key: str, png: bytes):
+        with self._lock:
+            self._entries[key] = png
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": sum(len(png) for png in self._entries.values()),
+                "hits": _hits.value,
+                "misses": _misses.value,
+            }
+
+
+_heatmap_cache = HeatmapCache()
+
+
+def get_heatmap_cache() -> HeatmapCache:
+    return _heatmap_cache
+
+
+@timed("render_pnl_heatmap_seconds")
+def render_pnl_heatmap(
+    pnl_matrix: np.ndarray,
+    spot_range: np.ndarray,
+    vol_range: np.ndarray,
+    title: str,
+    annotate: Optional[bool] = None,
+) -> bytes:
+    """png of the pnl matrix (rows = vols, columns = spots), annotated when both axes
+    have at most ANNOTATE_MAX_POINTS points unless annotate says otherwise"""
+    pnl_matrix = np.asarray(pnl_matrix, dtype=np.float64)
+    spot_range = np.asarray(spot_range, dtype=np.float64)
+    vol_range = np.asarray(vol_range, dtype=np.float64)
+    if pnl_matrix.shape != (vol_range.size, spot_range.size):
+        raise ValueError(
+            f"pnl matrix must be {(vol_range.size, spot_range.size)}, "
+            f"got {pnl_matrix.shape}"
+        )
+    if annotate is None:
+        annotate = max(pnl_matrix.shape) <= ANNOTATE_MAX_POINTS
+
+    key = grid_key(pnl_matrix, spot_range, vol_range, f"{title}|{annotate}")
+    png = _heatmap_cache.get(key)
+    if png is not None:
+        _hits.inc()
+        return png
+
+    _misses.inc()
+    png = _render(pnl_matrix, spot_range, vol_range, title, annotate)
+    _heatmap_cache.put(key, png)
+    return png
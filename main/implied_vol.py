@@ -0,0 +1,132 @@
+"""a file that backs implied volatility out of quoted option prices, whole chains are
+solved at once with a safeguarded newton (halley)/bisection hybrid on the shared
+black-scholes kernel"""
+
+from typing import Dict
+
+import numpy as np
+
+from exceptions import QueryError
+from main.logic import PRICE_KEYS, _ARRAY_OPS, _black_scholes, _input_columns
+
+CONTRACT_COLUMNS = ("StockPrice", "StrikePrice", "TimeToExpiry", "RiskFreeRate")
+
+VOL_FLOOR = 1e-6
+VOL_CAP = 10.0
+# newton steps in a row that may each fail to halve the one before, then bisect
+MAX_SLOW_STEPS = 3
+
+_SOLVER_KEYS = PRICE_KEYS + ("vega_raw", "volga")
+
+
+def implied_volatility(
+    prices,
+    inputs,
+    is_call=True,
+    tol: float = 1e-8,
+    vol_tol: float = 1e-10,
+    max_iter: int = 100,
+) -> Dict[str, np.ndarray]:
+    """solve sigma for every quoted price, inputs holds StockPrice, StrikePrice,
+    TimeToExpiry & RiskFreeRate (dict of arrays, DataFrame or structured array),
+    is_call broadcasts like the prices. converged means the vol is within tol to
+    first order (price error / vega) or the step or bracket shrank below vol_tol,
+    an absolute price error says nothing about the vol of a tiny premium. quotes
+    outside the no-arbitrage bounds come back as nan with converged=False"""
+    columns = _input_columns(inputs, CONTRACT_COLUMNS)
+    S, K, T, r, price, call_flag = (
+        np.ravel(a)
+        for a in np.broadcast_arrays(
+            *columns,
+            np.asarray(prices, dtype=np.float64),
+            np.asarray(is_call, dtype=bool),
+        )
+    )
+    shape = np.broadcast_shapes(columns[0].shape, np.shape(prices), np.shape(is_call))
+
+    if np.any(T <= 0):
+        raise QueryError("TimeToExpiry must be positive", f"{T.size} contracts")
+
+    discounted_K = K * np.exp(-r * T)
+
+    # the no-arbitrage bounds & the start point use the call through put-call
+    # parity, the iteration matches the quote itself since parity cancels away
+    # the digits of a tiny put premium
+    target = np.where(call_flag, price, price + S - discounted_K)
+    valid = (target > np.maximum(S - discounted_K, 0.0)) & (target < S)
+
+    sigma = np.full(S.size, np.nan)
+    iterations = np.zeros(S.size, dtype=np.int64)
+    converged = np.zeros(S.size, dtype=bool)
+
+    # the working set shrinks as elements finish
+    idx = np.flatnonzero(valid)
+    S, K, T, r = S[idx], K[idx], T[idx], r[idx]
+    discounted_K, target = discounted_K[idx], target[idx]
+    price, call_flag = price[idx], call_flag[idx]
+    lo = np.full(idx.size, VOL_FLOOR)
+    hi = np.full(idx.size, VOL_CAP)
+    slow = np.zeros(idx.size, dtype=np.int64)
+    last_move = np.full(idx.size, np.inf)
+
+    # corrado-miller start point, with the radicand clamped at zero far from the money
+    half_intrinsic = 0.5 * (S - discounted_K)
+    excess = target - half_intrinsic
+    radicand = np.maximum(excess * excess - 4.0 * half_intrinsic**2 / np.pi, 0.0)
+    current = (
+        np.sqrt(2.0 * np.pi / T) / (S + discounted_K) * (excess + np.sqrt(radicand))
+    )
+    current = np.clip(current, 0.01, VOL_CAP)
+
+    for iteration in range(1, max_iter + 1):
+        if idx.size == 0:
+            break
+
+        greeks = _black_scholes(S, K, T, r, current, _SOLVER_KEYS, _ARRAY_OPS)
+        vega = greeks["vega_raw"]
+        model = np.where(call_flag, greeks["call_price"], greeks["put_price"])
+        diff = model - price
+
+        # price is increasing in sigma, so the sign of diff tightens the bracket
+        above = diff > 0
+        lo = np.where(above, lo, current)
+        hi = np.where(above, current, hi)
+
+        # newton step with halley's volga correction
+        with np.errstate(divide="ignore", invalid="ignore"):
+            newton = diff / vega
+            step = current - newton / (1.0 - 0.5 * newton * greeks["volga"] / vega)
+        # fall back to bisection when the step leaves the bracket or vega vanishes,
+        # or when newton has crawled down the steep exponential of a far otm
+        # premium for a few steps that each failed to halve the previous one
+        move = np.abs(step - current)
+        slow = np.where(move < 0.5 * last_move, 0, slow + 1)
+        last_move = move
+        inside = (step > lo) & (step < hi) & (slow < MAX_SLOW_STEPS)
+        step = np.where(inside, step, 0.5 * (lo + hi))
+
+        vol_done = np.abs(diff) < tol * vega
+        done = vol_done | (np.abs(step - current) < vol_tol) | (hi - lo < vol_tol)
+        current = np.where(vol_done, current, step)
+
+        finished = idx[done]
+        sigma[finished] = current[done]
+        iterations[finished] = iteration
+        converged[finished] = True
+
+        keep = ~done
+        idx = idx[keep]
+        S, K, T, r = S[keep], K[keep], T[keep], r[keep]
+        price, call_flag = price[keep], call_flag[keep]
+        lo, hi, current = lo[keep], hi[keep], current[keep]
+        slow, last_move = slow[keep], last_move[keep]
+
+    # whatever is left ran out of iterations, report the last iterate
+    sigma[idx] = current
+    iterations[idx] = max_iter
+
+    return {
+        "implied_vol": sigma.reshape(shape),
+        "iterations": iterations.reshape(shape),
+        "converged": converged.reshape(shape),
+    }
@@ -0,0 +1,191 @@
+"""a file that prices american (and european) options on CRR binomial & trinomial
+lattices, many contracts at once with one backward induction vectorized over the
+contracts & the nodes of each time layer"""
+
+from typing import Dict, Iterable, NamedTuple, Tuple, Union
+
+import numpy as np
+
+from exceptions import QueryError
+from main.logic import (_ARRAY_OPS, DELTA_KEYS, GAMMA_KEYS, PRICE_KEYS,
+                        _black_scholes, _input_columns)
+from metrics import timed
+
+LATTICE_KEYS = PRICE_KEYS + DELTA_KEYS + GAMMA_KEYS
+METHODS = ("binomial", "trinomial")
+# "bbs" prices the last layer with black-scholes (Broadie-Detemple), which removes
+# the payoff kink's odd/even oscillation, "bbsr" adds richardson extrapolation over
+# steps & steps / 2 for roughly second order convergence
+SMOOTHING = (None, "bbs", "bbsr")
+
+MIN_STEPS = 8
+# contracts inducted together, small enough that a 100 step lattice's buffers stay
+# in cache instead of streaming through memory every layer
+CONTRACT_BLOCK = 2048
+
+
+class _Lattice(NamedTuple):
+    # branch probabilities from the lowest child up, one per contract
+    probabilities: Tuple[np.ndarray, ...]
+    discount: np.ndarray
+    # log spot distance between neighbouring nodes of one layer
+    node_step: np.ndarray
+    # layer whose 3 nodes straddle the spot, delta & gamma are read there
+    greeks_layer: int
+
+
+def _binomial(T, r, sigma, steps) -> _Lattice:
+    dt = T / steps
+    up = np.exp(sigma * np.sqrt(dt))
+    p = (np.exp(r * dt) - 1 / up) / (up - 1 / up)
+    if np.any((p < 0) | (p > 1)):
+        raise QueryError(
+            "Too few lattice steps for the rate & volatility", f"steps={steps}"
+        )
+    return _Lattice((1 - p, p), np.exp(-r * dt), 2 * np.log(up), 2)
+
+
+def _trinomial(T, r, sigma, steps) -> _Lattice:
+    dt = T / steps
+    dx = sigma * np.sqrt(3 * dt)
+    tilt = np.sqrt(dt / (12 * sigma * sigma)) * (r - 0.5 * sigma * sigma)
+    p_up, p_down = 1 / 6 + tilt, 1 / 6 - tilt
+    if np.any(p_down < 0) or np.any(p_up < 0):
+        raise QueryError(
+            "Too few lattice steps for the rate & volatility", f"steps={steps}"
+        )
+    return _Lattice((p_down, np.full_like(dt, 2 / 3), p_up), np.exp(-r * dt), dx, 1)
+
+
+_BUILDERS = {"binomial": _binomial, "trinomial": _trinomial}
+
+
+def _layer_spots(S, lattice: _Lattice, layer: int, method: str) -> np.ndarray:
+    """(nodes, contracts) spots of one layer, lowest node first"""
+    nodes = layer + 1 if method == "binomial" else 2 * layer + 1
+    offsets = np.arange(nodes) - (nodes - 1) / 2
+    return S * np.exp(lattice.node_step * offsets[:, np.newaxis])
+
+
+def _induct(S, K, T, r, sigma, steps, method, smoothing, american):
+    """call & put prices, deltas & gammas of 1-d contract arrays. calls & puts share
+    one (nodes, 2, contracts) buffer that every layer overwrites in place, so memory
+    is O(steps x contracts); contracts are the contiguous axis so each numpy call
+    streams whole nodes rather than looping over short per-contract rows"""
+    lattice = _BUILDERS[method](T, r, sigma, steps)
+    width = len(lattice.probabilities)
+    # +1 for the call's exercise value, -1 for the put's
+    sign = np.array([1.0, -1.0])[:, np.newaxis]
+
+    last = steps - 1 if smoothing else steps
+    spots = _layer_spots(S, lattice, last, method)
+    values = np.empty((spots.shape[0], 2, spots.shape[1]))
+    if smoothing:
+        # the last step has no early exercise inside it, so its continuation value
+        # is exactly the european price over one dt
+        dt = T / steps
+        prices = _black_scholes(spots, K, dt, r, sigma, PRICE_KEYS, _ARRAY_OPS)
+        values[:, 0], values[:, 1] = prices["call_price"], prices["put_price"]
+    else:
+        np.maximum(sign * (spots - K)[:, np.newaxis], 0.0, out=values)
+    if american:
+        np.maximum(values, sign * (spots - K)[:, np.newaxis], out=values)
+    acc, term = np.empty_like(values), np.empty_like(values)
+    up_move = np.exp(0.5 * lattice.node_step)
+
+    nodes = spots.shape[0]
+    for layer in range(last - 1, -1, -1):
+        nodes -= width - 1
+        out, scratch = acc[:nodes], term[:nodes]
+        np.multiply(values[:nodes], lattice.probabilities[0], out=out)
+        for i, p in enumerate(lattice.probabilities[1:], start=1):
+            out += np.multiply(values[i : i + nodes], p, out=scratch)
+        current = np.multiply(out, lattice.discount, out=values[:nodes])
+
+        if american:
+            # this layer's spots from the previous one's: the binomial keeps the
+            # lower nodes one up move higher, the trinomial drops the outer two
+            if method == "binomial":
+                spots = np.multiply(spots[:nodes], up_move, out=spots[:nodes])
+            else:
+                spots = spots[1 : nodes + 1]
+            np.subtract(spots, K, out=scratch[:, 0])
+            np.negative(scratch[:, 0], out=scratch[:, 1])
+            np.maximum(current, scratch, out=current)
+        if layer == lattice.greeks_layer:
+            layer_values = current.copy()
+
+    call, put = values[0]
+    down, mid, up = _layer_spots(S, lattice, lattice.greeks_layer, method)
+    (call_down, put_down), (call_mid, put_mid), (call_up, put_up) = layer_values
+
+    def gamma(low, centre, high):
+        return ((high - centre) / (up - mid) - (centre - low) / (mid - down)) / (
+            0.5 * (up - down)
+        )
+
+    return {
+        "call_price": call,
+        "put_price": put,
+        "call_delta": (call_up - call_down) / (up - down),
+        "put_delta": (put_up - put_down) / (up - down),
+        "call_gamma": gamma(call_down, call_mid, call_up),
+        "put_gamma": gamma(put_down, put_mid, put_up),
+    }
+
+
+def _resolve_lattice_outputs(outputs: Union[str, Iterable[str]]) -> Tuple[str, ...]:
+    if outputs == "prices":
+        return PRICE_KEYS
+    if isinstance(outputs, str):
+        raise QueryError("Unknown output level", outputs)
+    keys = tuple(outputs)
+    unknown = set(keys) - set(LATTICE_KEYS)
+    if unknown:
+        raise QueryError("Unknown output keys", ", ".join(sorted(unknown)))
+    return keys
+
+
+@timed("price_american_seconds")
+def price_american(
+    inputs,
+    outputs: Union[str, Iterable[str]] = "prices",
+    steps: int = 100,
+    method: str = "binomial",
+    smoothing: str = "bbsr",
+    american: bool = True,
+) -> Dict[str, np.ndarray]:
+    """lattice prices for the same inputs as price_options_batch (dict of scalars or
+    arrays, DataFrame, structured array), returned in the broadcast shape. outputs is
+    "prices" or keys from LATTICE_KEYS, so it drops in wherever a batch pricer is
+    called with "prices". american=False prices the european on the same lattice"""
+    if method not in METHODS:
+        raise QueryError("Unknown lattice method", method)
+    if smoothing not in SMOOTHING:
+        raise QueryError("Unknown lattice smoothing", str(smoothing))
+    if steps < MIN_STEPS:
+        raise QueryError(f"Lattices need at least {MIN_STEPS} steps", str(steps))
+    keys = _resolve_lattice_outputs(outputs)
+
+    columns = _input_columns(inputs)
+    shape = columns[0].shape
+    S, K, T, r, sigma = (column.ravel() for column in columns)
+    if np.any(T <= 0) or np.any(sigma <= 0):
+        raise QueryError(
+            "TimeToExpiry and Volatility must be positive", f"{T.size} contracts"
+        )
+
+    result = {key: np.empty(S.size) for key in keys}
+    for start in range(0, S.size, CONTRACT_BLOCK):
+        block = slice(start, start + CONTRACT_BLOCK)
+        contracts = (S[block], K[block], T[block], r[block], sigma[block])
+        fine = _induct(*contracts, steps, method, smoothing, american)
+        if smoothing == "bbsr":
+            coarse = _induct(*contracts, steps // 2, method, smoothing, american)
+        for key in keys:
+            if smoothing == "bbsr":
+                result[key][block] = 2 * fine[key] - coarse[key]
+            else:
+                result[key][block] = fine[key]
+
+    return {key: value.reshape(shape) for key, value in result.items()}
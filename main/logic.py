@@ -1,20 +1,95 @@
 """a file that prices put/call options based on basic"""
 
-from typing import Dict
+import math
+import sys
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, NamedTuple, Optional, Tuple, Union
 
-from numpy import exp, log, sqrt
-from scipy.stats import norm
+import numpy as np
 
-from db.migrate import run_migration
-from db.repositories.input_repo import InputRepository
-from decorators import time
 from exceptions import QueryError
 from logger import get_logger
+from metrics import timed
+from main.normal import array_cdf, array_pdf, scalar_cdf, scalar_pdf
 
 logger = get_logger(__file__)
 
+INPUT_COLUMNS = (
+    "StockPrice",
+    "StrikePrice",
+    "TimeToExpiry",
+    "RiskFreeRate",
+    "Volatility",
+)
+
+PRICE_KEYS = ("call_price", "put_price")
+DELTA_KEYS = ("call_delta", "put_delta")
+GAMMA_KEYS = ("call_gamma", "put_gamma")
+CALL_THETA_KEYS = ("call_theta_annual", "call_theta_daily")
+PUT_THETA_KEYS = ("put_theta_annual", "put_theta_daily")
+VEGA_KEYS = ("vega_raw", "vega_1pct")
+CALL_RHO_KEYS = ("call_rho_raw", "call_rho_1pct")
+PUT_RHO_KEYS = ("put_rho_raw", "put_rho_1pct")
+SECOND_ORDER_KEYS = ("vanna", "volga", "charm_annual", "charm_daily")
+
+FULL_KEYS = (
+    PRICE_KEYS
+    + DELTA_KEYS
+    + GAMMA_KEYS
+    + CALL_THETA_KEYS
+    + PUT_THETA_KEYS
+    + VEGA_KEYS
+    + CALL_RHO_KEYS
+    + PUT_RHO_KEYS
+)
+
+# named output sets accepted by price_option(outputs=...), "full" is the
+# historical 16 key dict
+OUTPUT_LEVELS = {
+    "prices": PRICE_KEYS,
+    "first_order": PRICE_KEYS
+    + DELTA_KEYS
+    + CALL_THETA_KEYS
+    + PUT_THETA_KEYS
+    + VEGA_KEYS
+    + CALL_RHO_KEYS
+    + PUT_RHO_KEYS,
+    "full": FULL_KEYS,
+    "second_order": FULL_KEYS + SECOND_ORDER_KEYS,
+}
+
+_ALL_KEYS = frozenset(OUTPUT_LEVELS["second_order"])
+
+# which outputs depend on each shared intermediate
+_NEEDS_DISCOUNT = frozenset(
+    PRICE_KEYS + CALL_THETA_KEYS + PUT_THETA_KEYS + CALL_RHO_KEYS + PUT_RHO_KEYS
+)
+_NEEDS_ND1 = frozenset(("call_price",) + DELTA_KEYS)
+_NEEDS_ND2 = frozenset(("call_price",) + CALL_THETA_KEYS + CALL_RHO_KEYS)
+_NEEDS_NMD2 = frozenset(("put_price",) + PUT_THETA_KEYS + PUT_RHO_KEYS)
+_NEEDS_PDF = frozenset(
+    GAMMA_KEYS + CALL_THETA_KEYS + PUT_THETA_KEYS + VEGA_KEYS + SECOND_ORDER_KEYS
+)
+
+class _Ops(NamedTuple):
+    exp: Callable
+    log: Callable
+    sqrt: Callable
+    cdf: Callable
+    pdf: Callable
+
+
+# every pricer goes through main.normal, plain math for scalars & the selected
+# array backend for batches
+_SCALAR_OPS = _Ops(math.exp, math.log, math.sqrt, scalar_cdf, scalar_pdf)
+_ARRAY_OPS = _Ops(np.exp, np.log, np.sqrt, array_cdf, array_pdf)
+
 
 def input_table_entry(current_inputs: Dict[str, float]):
+    # imported here so pricing never needs a database connection
+    from db.repositories.input_repo import InputRepository
+
     try:
         repo = InputRepository()
         repo.create_input(current_inputs)
@@ -22,8 +97,219 @@ def input_table_entry(current_inputs: Dict[str, float]):
         logger.error(f"Failed to insert inputs: {e}")
         raise
 
-@time
-def price_option(inputs: Dict[str, float]):
+
+class PriceCache:
+    """bounded LRU memo for price_option keyed on the five inputs & the requested
+    outputs. tolerance quantizes the inputs so near-identical scenarios share an
+    entry, eviction kicks in past max_entries or max_bytes (estimated)"""
+
+    def __init__(
+        self,
+        max_entries: int = 10_000,
+        max_bytes: Optional[int] = None,
+        tolerance: Optional[float] = None,
+    ):
+        if max_entries <= 0:
+            raise ValueError("max_entries must be positive")
+        if tolerance is not None and tolerance <= 0:
+            raise ValueError("tolerance must be positive")
+
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.tolerance = tolerance
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.current_bytes = 0
+
+    def make_key(self, values: Tuple[float, ...], keys: Tuple[str, ...]):
+        if self.tolerance is None:
+            return values + keys
+        return tuple(round(value / self.tolerance) for value in values) + keys
+
+    def get_or_compute(self, values, keys, compute: Callable[[], Dict]):
+        cache_key = self.make_key(values, keys)
+
+        with self._lock:
+            cached = self._entries.get(cache_key)
+            if cached is not None:
+                self._entries.move_to_end(cache_key)
+                self.hits += 1
+                return dict(cached[0])
+            self.misses += 1
+
+        result = compute()
+        size = (
+            sys.getsizeof(cache_key)
+            + sys.getsizeof(result)
+            + sum(sys.getsizeof(value) for value in result.values())
+        )
+
+        with self._lock:
+            previous = self._entries.pop(cache_key, None)
+            if previous is not None:
+                self.current_bytes -= previous[1]
+            self._entries[cache_key] = (result, size)
+            self.current_bytes += size
+            self._evict()
+
+        return dict(result)
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries or (
+            self.max_bytes is not None
+            and self.current_bytes > self.max_bytes
+            and len(self._entries) > 1
+        ):
+            _, (_, size) = self._entries.popitem(last=False)
+            self.current_bytes -= size
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._entries),
+                "bytes": self.current_bytes,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+# opt-in, price_option only consults the cache once enable_price_cache ran
+_price_cache: Optional[PriceCache] = None
+
+
+def enable_price_cache(
+    max_entries: int = 10_000,
+    max_bytes: Optional[int] = None,
+    tolerance: Optional[float] = None,
+) -> PriceCache:
+    global _price_cache
+    _price_cache = PriceCache(max_entries, max_bytes, tolerance)
+    return _price_cache
+
+
+def disable_price_cache():
+    global _price_cache
+    _price_cache = None
+
+
+def get_price_cache() -> Optional[PriceCache]:
+    return _price_cache
+
+
+def _resolve_outputs(outputs: Union[str, Iterable[str]]) -> Tuple[str, ...]:
+    if isinstance(outputs, str):
+        try:
+            return OUTPUT_LEVELS[outputs]
+        except KeyError:
+            raise QueryError("Unknown output level", outputs)
+
+    keys = tuple(outputs)
+    unknown = set(keys) - _ALL_KEYS
+    if unknown:
+        raise QueryError("Unknown output keys", ", ".join(sorted(unknown)))
+    return keys
+
+
+def _black_scholes(S, K, T, r, sigma, keys: Tuple[str, ...], ops: _Ops):
+    """shared kernel behind price_option & price_options_batch, every discount
+    factor, d1/d2 and normal cdf/pdf is computed at most once and only when one
+    of the requested keys depends on it"""
+    wanted = set(keys)
+
+    def want(names):
+        return not wanted.isdisjoint(names)
+
+    sqrt_T = ops.sqrt(T)
+    sigma_sqrt_T = sigma * sqrt_T
+    d1 = (ops.log(S / K) + (r + 0.5 * sigma * sigma) * T) / sigma_sqrt_T
+    d2 = d1 - sigma_sqrt_T
+
+    out = {}
+
+    if want(_NEEDS_DISCOUNT):
+        discounted_K = K * ops.exp(-r * T)
+    if want(_NEEDS_ND1):
+        Nd1 = ops.cdf(d1)
+    if want(_NEEDS_ND2):
+        Nd2 = ops.cdf(d2)
+    if "put_price" in wanted:
+        Nmd1 = ops.cdf(-d1)
+    if want(_NEEDS_NMD2):
+        Nmd2 = ops.cdf(-d2)
+    if want(_NEEDS_PDF):
+        nd1 = ops.pdf(d1)
+
+    if "call_price" in wanted:
+        out["call_price"] = S * Nd1 - discounted_K * Nd2
+    if "put_price" in wanted:
+        out["put_price"] = discounted_K * Nmd2 - S * Nmd1
+
+    if want(DELTA_KEYS):
+        out["call_delta"] = Nd1
+        out["put_delta"] = Nd1 - 1
+
+    if want(GAMMA_KEYS):
+        gamma = nd1 / (S * sigma_sqrt_T)
+        out["call_gamma"] = gamma
+        out["put_gamma"] = gamma
+
+    if want(CALL_THETA_KEYS + PUT_THETA_KEYS):
+        theta_decay = -(S * nd1 * sigma) / (2 * sqrt_T)
+    if want(CALL_THETA_KEYS):
+        call_theta = theta_decay - r * discounted_K * Nd2
+        out["call_theta_annual"] = call_theta
+        out["call_theta_daily"] = call_theta / 365
+    if want(PUT_THETA_KEYS):
+        put_theta = theta_decay + r * discounted_K * Nmd2
+        out["put_theta_annual"] = put_theta
+        out["put_theta_daily"] = put_theta / 365
+
+    if want(VEGA_KEYS + ("volga",)):
+        vega = S * sqrt_T * nd1
+        out["vega_raw"] = vega
+        out["vega_1pct"] = vega / 100
+
+    if want(CALL_RHO_KEYS):
+        call_rho = T * discounted_K * Nd2
+        out["call_rho_raw"] = call_rho
+        out["call_rho_1pct"] = call_rho / 100
+    if want(PUT_RHO_KEYS):
+        put_rho = -(T * discounted_K * Nmd2)
+        out["put_rho_raw"] = put_rho
+        out["put_rho_1pct"] = put_rho / 100
+
+    # second order, no dividend yield so call & put share vanna/volga/charm
+    if "vanna" in wanted:
+        out["vanna"] = -nd1 * d2 / sigma
+    if "volga" in wanted:
+        out["volga"] = vega * d1 * d2 / sigma
+    if want(("charm_annual", "charm_daily")):
+        charm = -nd1 * (2 * r * T - d2 * sigma_sqrt_T) / (2 * T * sigma_sqrt_T)
+        out["charm_annual"] = charm
+        out["charm_daily"] = charm / 365
+
+    return {key: out[key] for key in keys}
+
+
+@timed("price_option_seconds")
+def price_option(
+    inputs: Dict[str, float], outputs: Union[str, Iterable[str]] = "full"
+):
+    """price a single contract, outputs is a level from OUTPUT_LEVELS
+    ("prices", "first_order", "full", "second_order") or an iterable of keys"""
     try:
         S = inputs["StockPrice"]
         K = inputs["StrikePrice"]
@@ -31,61 +317,104 @@ def price_option(inputs: Dict[str, float]):
         r = inputs["RiskFreeRate"]
         sigma = inputs["Volatility"]
     except KeyError as e:
-        raise QueryError(f"Missing input: {e}")
+        raise QueryError("Missing input", str(e))
 
     if T <= 0 or sigma <= 0:
-        raise QueryError("TimeToExpiry and Volatility must be positive")
+        raise QueryError(
+            "TimeToExpiry and Volatility must be positive", f"T={T}, sigma={sigma}"
+        )
+    if S <= 0 or K <= 0:
+        raise QueryError("StockPrice and StrikePrice must be positive", f"S={S}, K={K}")
 
-    d1 = (log(S / K) + (r + 0.5 * sigma**2) * T) / (sigma * sqrt(T))
-    d2 = d1 - sigma * sqrt(T)
+    keys = _resolve_outputs(outputs)
+    cache = _price_cache
+    if cache is not None:
+        return cache.get_or_compute(
+            (S, K, T, r, sigma),
+            keys,
+            lambda: _black_scholes(S, K, T, r, sigma, keys, _SCALAR_OPS),
+        )
 
-    Nd1 = norm.cdf(d1)
-    Nd2 = norm.cdf(d2)
-    Nmd1 = norm.cdf(-d1)
-    Nmd2 = norm.cdf(-d2)
-    nd1 = norm.pdf(d1)
+    return _black_scholes(S, K, T, r, sigma, keys, _SCALAR_OPS)
 
-    call_price = S * Nd1 - K * exp(-r * T) * Nd2
-    put_price = K * exp(-r * T) * Nmd2 - S * Nmd1
 
-    call_delta = Nd1
-    put_delta = Nd1 - 1
+def _input_columns(inputs, names: Tuple[str, ...] = INPUT_COLUMNS):
+    """pull the named inputs out of a dict of arrays, a DataFrame or a structured array
+    and broadcast them against each other"""
+    try:
+        columns = [np.asarray(inputs[name], dtype=np.float64) for name in names]
+    except (KeyError, ValueError) as e:
+        raise QueryError("Missing input", str(e))
 
-    gamma = nd1 / (S * sigma * sqrt(T))
+    # log(S / K) needs both positive, every caller takes either or both
+    for name, column in zip(names, columns):
+        if name in ("StockPrice", "StrikePrice") and np.any(column <= 0):
+            raise QueryError(f"{name} must be positive", f"{column.size} values")
 
-    call_theta = (-(S * nd1 * sigma)/(2 * sqrt(T))) - (r * K * exp(-r * T) * Nd2)
-    put_theta = (-(S * nd1 * sigma)/(2 * sqrt(T))) + (r * K * exp(-r * T) * Nmd2)
+    try:
+        return np.broadcast_arrays(*columns)
+    except ValueError as e:
+        raise QueryError("Inputs cannot be broadcast together", str(e))
 
-    vega = S * sqrt(T) * nd1
 
-    call_rho = K * T * exp(-r * T) * Nd2
-    put_rho =  -(K * T * exp(-r * T) * Nmd2)
+@timed("price_options_batch_seconds")
+def price_options_batch(
+    inputs, outputs: Union[str, Iterable[str]] = "full"
+) -> Dict[str, np.ndarray]:
+    """vectorized price_option, returns the requested keys as columnar arrays"""
+    S, K, T, r, sigma = _input_columns(inputs)
+
+    if np.any(T <= 0) or np.any(sigma <= 0):
+        raise QueryError(
+            "TimeToExpiry and Volatility must be positive", f"{T.size} contracts"
+        )
+
+    return _black_scholes(S, K, T, r, sigma, _resolve_outputs(outputs), _ARRAY_OPS)
 
-    return {
-        "call_price": call_price,
-        "put_price": put_price,
-        "call_delta": call_delta,
-        "put_delta": put_delta,
-        "call_gamma": gamma,
-        "put_gamma": gamma,
-
-        "call_theta_annual": call_theta,
-        "put_theta_annual": put_theta,
-        "call_theta_daily": call_theta/365,
-        "put_theta_daily": put_theta/365,
-
-        "vega_raw": vega,
-        "vega_1pct": vega/100,
-
-        "call_rho_raw": call_rho,
-        "put_rho_raw": put_rho,
-        "call_rho_1pct": call_rho/100,
-        "put_rho_1pct": put_rho/100
-    }
+
+def price_chain(
+    spot: float,
+    strikes,
+    expiries,
+    vol_surface,
+    risk_free_rate=0.0,
+    outputs: Union[str, Iterable[str]] = "full",
+) -> Dict[str, np.ndarray]:
+    """price a strikes x expiries chain on one underlying. vol_surface broadcasts
+    to (len(strikes), len(expiries)) and risk_free_rate is a scalar or one rate
+    per expiry. discount & sqrt(T) terms are computed once per expiry and
+    log-moneyness once per strike before the kernel broadcasts them together"""
+    K = np.asarray(strikes, dtype=np.float64).reshape(-1, 1)
+    T = np.asarray(expiries, dtype=np.float64).reshape(1, -1)
+    r = np.asarray(risk_free_rate, dtype=np.float64)
+    if r.ndim:
+        r = r.reshape(1, -1)
+    sigma = np.asarray(vol_surface, dtype=np.float64)
+    shape = (K.shape[0], T.shape[1])
+
+    try:
+        sigma = np.broadcast_to(sigma, shape)
+        np.broadcast_shapes(r.shape, shape)
+    except ValueError as e:
+        raise QueryError("Chain inputs cannot be broadcast together", str(e))
+
+    if np.any(T <= 0) or np.any(sigma <= 0):
+        raise QueryError(
+            "TimeToExpiry and Volatility must be positive", f"{shape} chain"
+        )
+    if spot <= 0 or np.any(K <= 0):
+        raise QueryError(
+            "StockPrice and StrikePrice must be positive", f"{shape} chain"
+        )
+
+    prices = _black_scholes(
+        float(spot), K, T, r, sigma, _resolve_outputs(outputs), _ARRAY_OPS
+    )
+    return {key: np.broadcast_to(value, shape) for key, value in prices.items()}
 
 
 def entry_price(entry_inputs: Dict[str, float]):
-    prices = price_option(entry_inputs)
+    prices = price_option(entry_inputs, outputs="prices")
     return {
         "call_entry": prices["call_price"],
         "put_entry": prices["put_price"],
@@ -94,7 +423,40 @@ def entry_price(entry_inputs: Dict[str, float]):
 
 def pnl(current_inputs: Dict[str, float], entry_inputs: Dict[str, float]):
     entry = entry_price(entry_inputs)
-    current = price_option(current_inputs)
+    current = price_option(current_inputs, outputs="prices")
+
+    return {
+        "call_pnl": current["call_price"] - entry["call_entry"],
+        "put_pnl": current["put_price"] - entry["put_entry"],
+    }
+
+
+def pnl_grid(
+    entry_inputs: Dict[str, float],
+    spot_range: np.ndarray,
+    vol_range: np.ndarray,
+    pricer: Optional[Callable] = None,
+) -> Dict[str, np.ndarray]:
+    """call & put pnl over the spot x vol mesh, rows follow vol_range and columns
+    follow spot_range; the entry position is priced once. pricer swaps the model,
+    any batch pricer called like price_options_batch(inputs, "prices") works, e.g.
+    main.lattice.price_american"""
+    if pricer is None:
+        pricer = price_options_batch
+        entry = entry_price(entry_inputs)
+    else:
+        prices = pricer(entry_inputs, "prices")
+        entry = {
+            "call_entry": float(prices["call_price"]),
+            "put_entry": float(prices["put_price"]),
+        }
+
+    grid_inputs = dict(
+        entry_inputs,
+        StockPrice=np.asarray(spot_range, dtype=np.float64)[np.newaxis, :],
+        Volatility=np.asarray(vol_range, dtype=np.float64)[:, np.newaxis],
+    )
+    current = pricer(grid_inputs, "prices")
 
     return {
         "call_pnl": current["call_price"] - entry["call_entry"],
@@ -103,6 +465,8 @@ def pnl(current_inputs: Dict[str, float], entry_inputs: Dict[str, float]):
 
 
 if __name__ == "__main__":
+    from db.migrate import run_migration
+
     run_migration()
 
     entry_inputs = {
@@ -0,0 +1,268 @@
+"""a file that prices path-dependent options (asian, barrier, lookback) by monte carlo
+on the price_option input schema, gbm paths are simulated in bounded chunks with
+optional antithetic variates, a black-scholes control variate & a process pool"""
+
+import math
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from exceptions import QueryError
+from main.logic import INPUT_COLUMNS, price_option
+from metrics import counter, timed
+
+PAYOFFS = (
+    "european",
+    "asian_arithmetic",
+    "asian_geometric",
+    "up_and_out",
+    "up_and_in",
+    "down_and_out",
+    "down_and_in",
+    "lookback_floating",
+    "lookback_fixed",
+)
+BARRIER_PAYOFFS = frozenset(PAYOFFS[3:7])
+
+# floats per simulated chunk (paths x steps), 2**21 is 16 MiB of float64 and bounds
+# memory whatever the path count
+CHUNK_ELEMENTS = 2**21
+
+_paths = counter("monte_carlo_paths_total")
+
+# running sums merged across chunks: count, y, y^2, x, x^2, x*y where y is the
+# discounted payoff & x the discounted european payoff (the control)
+_N, _SY, _SYY, _SX, _SXX, _SXY = range(6)
+
+
+class _Chunk(NamedTuple):
+    """everything a worker needs to simulate one chunk, picklable for the pool"""
+
+    params: Tuple[float, ...]
+    payoff: str
+    is_call: bool
+    barrier: Optional[float]
+    paths: int
+    steps: int
+    antithetic: bool
+    seed: np.random.SeedSequence
+
+
+def _vanilla(prices, strike, is_call):
+    if is_call:
+        return np.maximum(prices - strike, 0.0)
+    return np.maximum(strike - prices, 0.0)
+
+
+def _payoff(chunk: _Chunk, S0, K, log_paths) -> Tuple[np.ndarray, np.ndarray]:
+    """undiscounted (payoff, european payoff) per path, log_paths holds log(S_t / S0)
+    for the monitoring dates t = dt..T, one row per path"""
+    terminal = S0 * np.exp(log_paths[:, -1])
+    european = _vanilla(terminal, K, chunk.is_call)
+    payoff = chunk.payoff
+
+    if payoff == "european":
+        return european, european
+    if payoff == "asian_arithmetic":
+        average = S0 * np.exp(log_paths).mean(axis=1)
+        return _vanilla(average, K, chunk.is_call), european
+    if payoff == "asian_geometric":
+        average = S0 * np.exp(log_paths.mean(axis=1))
+        return _vanilla(average, K, chunk.is_call), european
+
+    if payoff in BARRIER_PAYOFFS:
+        # discretely monitored at every step, a continuous barrier is hit more often
+        log_barrier = math.log(chunk.barrier / S0)
+        if payoff.startswith("up"):
+            hit = log_paths.max(axis=1) >= log_barrier
+        else:
+            hit = log_paths.min(axis=1) <= log_barrier
+        alive = ~hit if payoff.endswith("out") else hit
+        return np.where(alive, european, 0.0), european
+
+    highest = S0 * np.exp(np.maximum(log_paths.max(axis=1), 0.0))
+    lowest = S0 * np.exp(np.minimum(log_paths.min(axis=1), 0.0))
+    if payoff == "lookback_floating":
+        value = terminal - lowest if chunk.is_call else highest - terminal
+    else:  # lookback_fixed
+        value = _vanilla(highest if chunk.is_call else lowest, K, chunk.is_call)
+    return value, european
+
+
+def _simulate_chunk(chunk: _Chunk) -> np.ndarray:
+    S0, K, T, r, sigma = chunk.params
+    dt = T / chunk.steps
+    drift = (r - 0.5 * sigma * sigma) * dt
+    diffusion = sigma * math.sqrt(dt)
+    rng = np.random.default_rng(chunk.seed)
+
+    draws = chunk.paths // 2 if chunk.antithetic else chunk.paths
+    shocks = np.empty((chunk.paths, chunk.steps))
+    rng.standard_normal(out=shocks[:draws])
+    if chunk.antithetic:
+        np.negative(shocks[:draws], out=shocks[draws:])
+    shocks *= diffusion
+    shocks += drift
+    log_paths = np.cumsum(shocks, axis=1, out=shocks)
+
+    discount = math.exp(-r * T)
+    y, x = _payoff(chunk, S0, K, log_paths)
+    y, x = y * discount, x * discount
+    if chunk.antithetic:
+        # each antithetic pair is one independent sample
+        y = 0.5 * (y[:draws] + y[draws:])
+        x = 0.5 * (x[:draws] + x[draws:])
+
+    return np.array([y.size, y.sum(), y @ y, x.sum(), x @ x, x @ y])
+
+
+def _contract(inputs: Dict[str, float]) -> Tuple[float, ...]:
+    try:
+        params = tuple(float(inputs[name]) for name in INPUT_COLUMNS)
+    except KeyError as e:
+        raise QueryError("Missing input", str(e))
+    S, K, T, r, sigma = params
+    if T <= 0 or sigma <= 0:
+        raise QueryError(
+            "TimeToExpiry and Volatility must be positive", f"T={T}, sigma={sigma}"
+        )
+    return params
+
+
+def _chunks(
+    params, payoff, is_call, barrier, paths, steps, antithetic, seed, chunk_size
+) -> List[_Chunk]:
+    if chunk_size is None:
+        chunk_size = max(2, CHUNK_ELEMENTS // steps)
+    if antithetic:
+        # pairs never straddle chunks
+        chunk_size += chunk_size % 2
+        paths += paths % 2
+
+    sizes = [chunk_size] * (paths // chunk_size)
+    if paths % chunk_size:
+        sizes.append(paths % chunk_size)
+    # one independent stream per chunk, so the result doesn't depend on the workers
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    return [
+        _Chunk(params, payoff, is_call, barrier, size, steps, antithetic, chunk_seed)
+        for size, chunk_seed in zip(sizes, seeds)
+    ]
+
+
+def _estimate(sums: np.ndarray, control_price: Optional[float]) -> Tuple[float, ...]:
+    """(price, standard error, beta), beta is 0 without a control variate"""
+    n = sums[_N]
+    mean_y = sums[_SY] / n
+    var_y = max(sums[_SYY] / n - mean_y * mean_y, 0.0) * n / max(n - 1, 1)
+    if control_price is None:
+        return mean_y, math.sqrt(var_y / n), 0.0
+
+    mean_x = sums[_SX] / n
+    var_x = max(sums[_SXX] / n - mean_x * mean_x, 0.0) * n / max(n - 1, 1)
+    cov = (sums[_SXY] / n - mean_x * mean_y) * n / max(n - 1, 1)
+    beta = cov / var_x if var_x > 0 else 0.0
+    price = mean_y - beta * (mean_x - control_price)
+    var = max(var_y - 2 * beta * cov + beta * beta * var_x, 0.0)
+    return price, math.sqrt(var / n), beta
+
+
+@timed("price_monte_carlo_seconds")
+def price_monte_carlo(
+    inputs: Dict[str, float],
+    payoff: str = "european",
+    is_call: bool = True,
+    paths: int = 100_000,
+    steps: int = 252,
+    barrier: Optional[float] = None,
+    antithetic: bool = True,
+    control_variate: bool = True,
+    seed: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+    workers: Optional[int] = None,
+) -> Dict[str, float]:
+    """price one contract (same inputs as price_option) with a payoff from PAYOFFS,
+    monitored at `steps` equally spaced dates. the control variate is the european
+    option on the same paths, whose exact price comes from price_option. workers > 1
+    spreads the chunks over a process pool, the same seed gives the same price
+    either way"""
+    params = _contract(inputs)
+    if payoff not in PAYOFFS:
+        raise QueryError("Unknown payoff", payoff)
+    if payoff in BARRIER_PAYOFFS and (barrier is None or barrier <= 0):
+        raise QueryError("Barrier payoffs need a positive barrier", str(barrier))
+    if paths < 2 or steps < 1:
+        raise QueryError("Need at least 2 paths and 1 step", f"{paths}x{steps}")
+    if payoff == "european":
+        steps = 1  # only the terminal price matters
+
+    chunks = _chunks(
+        params, payoff, is_call, barrier, paths, steps, antithetic, seed, chunk_size
+    )
+    start = time.perf_counter()
+    if workers and workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            sums = sum(pool.map(_simulate_chunk, chunks))
+    else:
+        sums = sum(_simulate_chunk(chunk) for chunk in chunks)
+    seconds = time.perf_counter() - start
+
+    control_price = None
+    if control_variate:
+        prices = price_option(inputs, outputs="prices")
+        control_price = prices["call_price" if is_call else "put_price"]
+
+    simulated = sum(chunk.paths for chunk in chunks)
+    _paths.inc(simulated)
+    price, std_error, beta = _estimate(sums, control_price)
+    return {
+        "price": float(price),
+        "std_error": float(std_error),
+        "control_beta": float(beta),
+        "paths": simulated,
+        "steps": steps,
+        "seconds": seconds,
+        "paths_per_sec": simulated / seconds if seconds > 0 else math.inf,
+    }
+
+
+def validate_european(
+    inputs: Dict[str, float], paths: int = 200_000, seed: int = 0, max_z: float = 4.0
+) -> Dict[str, float]:
+    """monte carlo european call & put (no control variate, it would return the
+    closed form exactly) against price_option, ok when both are within max_z
+    standard errors"""
+    exact = price_option(inputs, outputs="prices")
+    report = {}
+    for is_call, key in ((True, "call_price"), (False, "put_price")):
+        estimate = price_monte_carlo(
+            inputs, is_call=is_call, paths=paths, control_variate=False, seed=seed
+        )
+        z = (estimate["price"] - exact[key]) / estimate["std_error"]
+        report[f"{key}_mc"] = estimate["price"]
+        report[key] = exact[key]
+        report[f"{key}_z"] = float(z)
+    report["ok"] = all(
+        abs(report[f"{key}_z"]) <= max_z for key in ("call_price", "put_price")
+    )
+    return report
+
+
+if __name__ == "__main__":
+    contract = {
+        "StockPrice": 100.0,
+        "StrikePrice": 100.0,
+        "TimeToExpiry": 1.0,
+        "RiskFreeRate": 0.05,
+        "Volatility": 0.25,
+    }
+    print(validate_european(contract))
+    for name in PAYOFFS:
+        barrier = 120.0 if name.startswith("up") else 80.0
+        result = price_monte_carlo(contract, payoff=name, barrier=barrier, seed=0)
+        print(
+            f"{name:<18} {result['price']:9.4f} ± {result['std_error']:.4f} "
+            f"({result['paths_per_sec']:,.0f} paths/s)"
+        )
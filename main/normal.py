@@ -0,0 +1,181 @@
+"""a file with low-overhead standard normal cdf/pdf kernels used by the pricers,
+a pure math scalar path plus an array path whose backend is picked at import time"""
+
+import importlib.util
+import math
+import os
+import timeit
+
+import numpy as np
+
+from logger import get_logger
+
+logger = get_logger(__file__)
+
+_SQRT_2 = math.sqrt(2.0)
+_INV_SQRT_2PI = 1.0 / math.sqrt(2.0 * math.pi)
+
+
+# scalar fast path, plain python floats in & out
+def scalar_cdf(x: float) -> float:
+    return 0.5 * math.erfc(-x / _SQRT_2)
+
+
+def scalar_pdf(x: float) -> float:
+    return _INV_SQRT_2PI * math.exp(-0.5 * x * x)
+
+
+# numpy path, always available
+_ndtr = None
+
+
+def _numpy_cdf(x):
+    # scipy.special costs more to import than numpy itself, so it waits for the
+    # first array call & scalar-only callers never load it
+    global _ndtr
+    if _ndtr is None:
+        from scipy.special import ndtr as _ndtr
+    return _ndtr(x)
+
+
+def _numpy_pdf(x):
+    x = np.asarray(x, dtype=np.float64)
+    return _INV_SQRT_2PI * np.exp(-0.5 * x * x)
+
+
+_numba_kernels = None
+
+
+def _compile_numba():
+    # first array call only, importing numba & loading the kernels even from its
+    # on-disk cache costs seconds that a cold start shouldn't pay
+    global _numba_kernels
+    if _numba_kernels is None:
+        import numba
+
+        # the scalar kernels compile as they are, they must stay module level since
+        # numba's on-disk cache finds a function by module & qualified name & would
+        # recompile a closure in every new process
+        vectorize = numba.vectorize(["float64(float64)"], nopython=True, cache=True)
+        _numba_kernels = vectorize(scalar_cdf), vectorize(scalar_pdf)
+    return _numba_kernels
+
+
+def _numba_cdf(x):
+    return _compile_numba()[0](x)
+
+
+def _numba_pdf(x):
+    return _compile_numba()[1](x)
+
+
+def _load_numba():
+    # only checks numba is installed, the kernels are built on the first call
+    if importlib.util.find_spec("numba") is None:
+        raise ImportError("No module named 'numba'")
+    return _numba_cdf, _numba_pdf
+
+
+def _load_numexpr():
+    import numexpr
+
+    # numexpr has no erf, so only the pdf moves over & the cdf stays on ndtr
+    def pdf(x):
+        x = np.asarray(x, dtype=np.float64)
+        return numexpr.evaluate(
+            "inv_sqrt_2pi * exp(-0.5 * x * x)",
+            local_dict={"x": x, "inv_sqrt_2pi": _INV_SQRT_2PI},
+        )
+
+    return _numpy_cdf, pdf
+
+
+_LOADERS = {
+    "numba": _load_numba,
+    "numexpr": _load_numexpr,
+}
+
+
+def available_backends():
+    """name -> (cdf, pdf) for every array backend importable here"""
+    backends = {"numpy": (_numpy_cdf, _numpy_pdf)}
+    for name, loader in _LOADERS.items():
+        try:
+            backends[name] = loader()
+        except ImportError:
+            continue
+    return backends
+
+
+def _select_backend():
+    # NORMAL_BACKEND forces a backend, otherwise the fastest importable one wins
+    requested = os.getenv("NORMAL_BACKEND")
+    candidates = [requested] if requested else ["numba", "numexpr"]
+
+    for name in candidates:
+        if name == "numpy":
+            break
+        loader = _LOADERS.get(name)
+        if loader is None:
+            logger.warning("unknown normal backend %s, using numpy", name)
+            break
+        try:
+            return (name,) + loader()
+        except ImportError:
+            if requested:
+                logger.warning("normal backend %s not installed, using numpy", name)
+
+    return "numpy", _numpy_cdf, _numpy_pdf
+
+
+BACKEND, array_cdf, array_pdf = _select_backend()
+
+
+def cdf(x):
+    if isinstance(x, (float, int)):
+        return scalar_cdf(x)
+    return array_cdf(x)
+
+
+def pdf(x):
+    if isinstance(x, (float, int)):
+        return scalar_pdf(x)
+    return array_pdf(x)
+
+
+def benchmark(sizes=(1, 1_000, 1_000_000), repeat: int = 5):
+    """per-call latency (seconds) of cdf & pdf for every backend and input size"""
+    results = []
+    backends = {"math": (scalar_cdf, scalar_pdf)}
+    backends.update(available_backends())
+    rng = np.random.default_rng(0)
+
+    for size in sizes:
+        values = rng.standard_normal(size)
+        for name, (cdf_fn, pdf_fn) in backends.items():
+            if name == "math" and size != 1:
+                continue
+            arg = float(values[0]) if name == "math" else values
+            number = max(1, 100_000 // size)
+            for kind, fn in (("cdf", cdf_fn), ("pdf", pdf_fn)):
+                fn(arg)  # warm up, numba compiles on first call
+                best = min(timeit.repeat(lambda: fn(arg), number=number, repeat=repeat))
+                results.append(
+                    {
+                        "backend": name,
+                        "function": kind,
+                        "size": size,
+                        "seconds_per_call": best / number,
+                    }
+                )
+
+    return results
+
+
+if __name__ == "__main__":
+    print(f"selected array backend: {BACKEND}")
+    for row in benchmark():
+        print(
+            f"{row['backend']:>8} {row['function']} size={row['size']:>9,d} "
+            f"{row['seconds_per_call'] * 1e6:12.3f} us/call"
+        )
@@ -0,0 +1,243 @@
+"""a file that values whole books of option positions at once, positions are held in
+columnar arrays and repriced with one price_options_batch call, greeks are netted by
+underlying & expiry and pnl heatmaps shock every position together"""
+
+from typing import Dict, Iterable, Mapping, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from exceptions import QueryError
+from main.logic import price_options_batch
+from metrics import timed
+
+POSITION_COLUMNS = (
+    "Underlying",
+    "IsCall",
+    "Quantity",
+    "StrikePrice",
+    "TimeToExpiry",
+    "EntryPrice",
+)
+GREEKS = ("delta", "gamma", "vega", "theta", "rho")
+GROUP_KEYS = ("underlying", "expiry")
+
+# kernel keys behind each netted greek, (call, put); vega, theta & rho are per
+# 1 vol point, per day & per 1% rate like the ui shows them
+_GREEK_KEYS = {
+    "delta": ("call_delta", "put_delta"),
+    "gamma": ("call_gamma", "put_gamma"),
+    "vega": ("vega_1pct", "vega_1pct"),
+    "theta": ("call_theta_daily", "put_theta_daily"),
+    "rho": ("call_rho_1pct", "put_rho_1pct"),
+}
+
+# (vol rows x spot columns x positions) floats repriced at once by pnl_grid
+GRID_CHUNK_ELEMENTS = 2**18
+
+MarketValue = Union[float, Mapping[str, float], Sequence[float], np.ndarray]
+
+
+class Portfolio:
+    """a book of positions, one array per column. quantity is signed (short < 0),
+    entry_price is the premium per unit paid or received when the position opened"""
+
+    def __init__(
+        self,
+        underlying: Sequence[str],
+        is_call,
+        quantity,
+        strike,
+        expiry,
+        entry_price,
+    ):
+        self.underlying = np.asarray(underlying, dtype=str)
+        self.is_call = np.asarray(is_call, dtype=bool)
+        self.quantity = np.asarray(quantity, dtype=np.float64)
+        self.strike = np.asarray(strike, dtype=np.float64)
+        self.expiry = np.asarray(expiry, dtype=np.float64)
+        self.entry_price = np.asarray(entry_price, dtype=np.float64)
+
+        columns = (
+            self.underlying,
+            self.is_call,
+            self.quantity,
+            self.strike,
+            self.expiry,
+            self.entry_price,
+        )
+        if len({column.shape for column in columns}) != 1 or self.underlying.ndim != 1:
+            raise QueryError(
+                "Position columns must be 1-d and of equal length",
+                ", ".join(str(column.shape) for column in columns),
+            )
+        if np.any(self.expiry <= 0):
+            raise QueryError("TimeToExpiry must be positive", f"{len(self)} positions")
+
+        # underlying names -> small ints, markets & groupings index with these
+        self.underlyings, self._underlying_codes = np.unique(
+            self.underlying, return_inverse=True
+        )
+
+    @classmethod
+    def from_records(cls, records) -> "Portfolio":
+        """from a DataFrame, structured array or dict of columns keyed by
+        POSITION_COLUMNS, or an iterable of per-position dicts with those keys"""
+        if isinstance(records, (list, tuple)):
+            records = {
+                name: [record[name] for record in records] for name in POSITION_COLUMNS
+            }
+        try:
+            columns = [np.asarray(records[name]) for name in POSITION_COLUMNS]
+        except (KeyError, ValueError) as e:
+            raise QueryError("Missing position column", str(e))
+        return cls(*columns)
+
+    def __len__(self) -> int:
+        return self.underlying.size
+
+    def _per_position(self, name: str, value: MarketValue) -> np.ndarray:
+        """scalar, {underlying: value} or one value per position"""
+        if isinstance(value, Mapping):
+            missing = set(self.underlyings) - set(value)
+            if missing:
+                raise QueryError(
+                    f"No {name} for underlying", ", ".join(sorted(missing))
+                )
+            by_code = np.array([value[code] for code in self.underlyings], dtype=float)
+            return by_code[self._underlying_codes]
+
+        value = np.asarray(value, dtype=np.float64)
+        if value.ndim and value.shape != (len(self),):
+            raise QueryError(f"{name} needs one value per position", str(value.shape))
+        return np.broadcast_to(value, (len(self),))
+
+    def _inputs(self, market: Mapping[str, MarketValue]) -> Dict[str, np.ndarray]:
+        try:
+            spot, vol, rate = (
+                market[name] for name in ("StockPrice", "Volatility", "RiskFreeRate")
+            )
+        except KeyError as e:
+            raise QueryError("Missing market input", str(e))
+        return {
+            "StockPrice": self._per_position("StockPrice", spot),
+            "StrikePrice": self.strike,
+            "TimeToExpiry": self.expiry,
+            "RiskFreeRate": self._per_position("RiskFreeRate", rate),
+            "Volatility": self._per_position("Volatility", vol),
+        }
+
+    def _select(self, prices: Dict[str, np.ndarray], call_key: str, put_key: str):
+        return np.where(self.is_call, prices[call_key], prices[put_key])
+
+    @timed("portfolio_revalue_seconds")
+    def revalue(self, market: Mapping[str, MarketValue]) -> Dict[str, np.ndarray]:
+        """per position unit price, pnl (quantity x (price - entry)) & position
+        greeks (quantity x unit greek), one kernel pass over the whole book"""
+        keys = ("call_price", "put_price") + tuple(
+            sorted({key for pair in _GREEK_KEYS.values() for key in pair})
+        )
+        prices = price_options_batch(self._inputs(market), keys)
+
+        price = self._select(prices, "call_price", "put_price")
+        result = {
+            "price": price,
+            "pnl": self.quantity * (price - self.entry_price),
+        }
+        for greek, (call_key, put_key) in _GREEK_KEYS.items():
+            result[greek] = self.quantity * self._select(prices, call_key, put_key)
+        return result
+
+    def _groups(self, by: Tuple[str, ...]):
+        if not by:
+            return {}, np.zeros(len(self), dtype=np.int64), 1
+        unknown = set(by) - set(GROUP_KEYS)
+        if unknown:
+            raise QueryError("Unknown group key", ", ".join(sorted(unknown)))
+
+        # each key as (distinct values, code per position), then one combined code;
+        # np.unique over integer codes is far cheaper than over rows of floats
+        columns = {
+            "underlying": (self.underlyings, self._underlying_codes),
+            "expiry": np.unique(self.expiry, return_inverse=True),
+        }
+        combined = np.zeros(len(self), dtype=np.int64)
+        for name in by:
+            values, codes = columns[name]
+            combined = combined * values.size + codes.ravel()
+        groups, inverse = np.unique(combined, return_inverse=True)
+        count = groups.size
+
+        labels = {}
+        for name in reversed(by):
+            values, _ = columns[name]
+            labels[name] = values[groups % values.size]
+            groups = groups // values.size
+        return {name: labels[name] for name in by}, inverse.ravel(), count
+
+    def net_greeks(
+        self,
+        market: Mapping[str, MarketValue],
+        by: Iterable[str] = GROUP_KEYS,
+    ) -> Dict[str, np.ndarray]:
+        """columnar netted greeks & pnl, one row per distinct combination of the
+        `by` keys ("underlying", "expiry"), by=() nets the whole book"""
+        labels, inverse, groups = self._groups(tuple(by))
+        values = self.revalue(market)
+        netted = dict(labels)
+        netted["positions"] = np.bincount(inverse, minlength=groups)
+        for name in ("pnl",) + GREEKS:
+            netted[name] = np.bincount(inverse, weights=values[name], minlength=groups)
+        return netted
+
+    @timed("portfolio_pnl_grid_seconds")
+    def pnl_grid(
+        self,
+        market: Mapping[str, MarketValue],
+        spot_shocks,
+        vol_shocks,
+        relative_spot: bool = True,
+        underlying: Optional[str] = None,
+    ) -> np.ndarray:
+        """total book pnl with every spot shocked by spot_shocks (relative, 0.05 is
+        +5%, or absolute) and every vol by vol_shocks (absolute, 0.02 is +2 vol
+        points), rows follow vol_shocks and columns spot_shocks. underlying limits
+        the shock to one name, the rest of the book stays at market"""
+        inputs = self._inputs(market)
+        spot_shocks = np.asarray(spot_shocks, dtype=np.float64)
+        vol_shocks = np.asarray(vol_shocks, dtype=np.float64)
+
+        shocked = np.ones(len(self), dtype=bool)
+        if underlying is not None:
+            shocked = self.underlying == underlying
+            if not shocked.any():
+                raise QueryError("No positions on underlying", underlying)
+
+        spot = inputs["StockPrice"][np.newaxis, :]
+        if relative_spot:
+            spots = spot * np.where(shocked, 1 + spot_shocks[:, np.newaxis], 1.0)
+        else:
+            spots = spot + np.where(shocked, spot_shocks[:, np.newaxis], 0.0)
+        if np.any(spots <= 0):
+            raise QueryError("Spot shocks make a price non-positive", str(spot_shocks))
+
+        put_offset = self.strike * np.exp(-inputs["RiskFreeRate"] * self.expiry)
+
+        # every position's pnl over spots for a block of vol rows per kernel pass,
+        # the (rows x spots x positions) block is bounded by GRID_CHUNK_ELEMENTS
+        rows_per_chunk = max(1, GRID_CHUNK_ELEMENTS // max(spots.size, 1))
+        grid = np.empty((vol_shocks.size, spot_shocks.size))
+        for start in range(0, vol_shocks.size, rows_per_chunk):
+            rows = vol_shocks[start : start + rows_per_chunk, np.newaxis, np.newaxis]
+            vols = inputs["Volatility"] + np.where(shocked, rows, 0.0)
+            if np.any(vols <= 0):
+                raise QueryError("Vol shocks make a volatility non-positive", str(rows))
+            call = price_options_batch(
+                dict(inputs, StockPrice=spots[np.newaxis], Volatility=vols),
+                ("call_price",),
+            )["call_price"]
+            # puts through put-call parity, half the normal cdfs of pricing both
+            price = np.where(self.is_call, call, call - spots + put_offset)
+            grid[start : start + rows.shape[0]] = (
+                (price - self.entry_price) @ self.quantity
+            )
+        return grid
@@ -0,0 +1,118 @@
+"""a file that keeps the last pnl grid around & recomputes only the rows/columns whose
+axis points weren't in it, so an extended axis prices just the new cells"""
+
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from main.logic import INPUT_COLUMNS, pnl_grid
+from metrics import counter
+
+PNL_KEYS = ("call_pnl", "put_pnl")
+
+# axis points this close (relative) are the same scenario, linspace endpoints &
+# refinements land within a few ulps of the previous axis
+MATCH_RTOL = 1e-12
+# below this share of reusable cells the whole grid is repriced
+MIN_REUSE = 0.5
+
+_reused = counter("pnl_grid_cells_reused_total")
+_computed = counter("pnl_grid_cells_computed_total")
+
+
+def entry_key(entry_inputs: Dict[str, float]) -> Tuple[float, ...]:
+    return tuple(float(entry_inputs[name]) for name in INPUT_COLUMNS)
+
+
+def match_axis(new: np.ndarray, old: np.ndarray) -> np.ndarray:
+    """index into old of each point in new, -1 where old has no such point"""
+    if old.size == 0:
+        return np.full(new.shape, -1)
+    order = np.argsort(old, kind="stable")
+    sorted_old = old[order]
+    right = np.minimum(np.searchsorted(sorted_old, new), old.size - 1)
+    left = np.maximum(right - 1, 0)
+    nearest = np.where(
+        np.abs(sorted_old[left] - new) <= np.abs(sorted_old[right] - new), left, right
+    )
+    found = np.isclose(sorted_old[nearest], new, rtol=MATCH_RTOL, atol=0.0)
+    return np.where(found, order[nearest], -1)
+
+
+class IncrementalPnlGrid:
+    """the previous grid & its axes, update() copies every cell whose spot & vol were
+    both priced before and runs pnl_grid on the rest. one per ui session, the entry
+    position changing throws everything away"""
+
+    def __init__(self):
+        self._entry: Optional[Tuple[float, ...]] = None
+        self.spot_range = np.empty(0)
+        self.vol_range = np.empty(0)
+        self.grid: Dict[str, np.ndarray] = {}
+
+    def remember(
+        self,
+        entry_inputs: Dict[str, float],
+        spot_range: np.ndarray,
+        vol_range: np.ndarray,
+        grid: Dict[str, np.ndarray],
+    ):
+        """make grid the base of the next update, e.g. after a cache hit elsewhere"""
+        self._entry = entry_key(entry_inputs)
+        self.spot_range = np.asarray(spot_range, dtype=np.float64)
+        self.vol_range = np.asarray(vol_range, dtype=np.float64)
+        self.grid = grid
+
+    def update(
+        self,
+        entry_inputs: Dict[str, float],
+        spot_range: np.ndarray,
+        vol_range: np.ndarray,
+    ) -> Dict[str, np.ndarray]:
+        spot_range = np.asarray(spot_range, dtype=np.float64)
+        vol_range = np.asarray(vol_range, dtype=np.float64)
+
+        if entry_key(entry_inputs) != self._entry:
+            rows = np.full(vol_range.shape, -1)
+            cols = np.full(spot_range.shape, -1)
+        else:
+            rows = match_axis(vol_range, self.vol_range)
+            cols = match_axis(spot_range, self.spot_range)
+        old_rows, old_cols = rows >= 0, cols >= 0
+        new_rows, new_cols = ~old_rows, ~old_cols
+
+        reused = int(old_rows.sum()) * int(old_cols.sum())
+        if reused < MIN_REUSE * vol_range.size * spot_range.size:
+            # copying scattered cells costs about as much as pricing them
+            old_rows[:], old_cols[:] = False, False
+            new_rows[:], new_cols[:] = True, True
+            reused = 0
+
+        shape = (vol_range.size, spot_range.size)
+        grid = {key: np.empty(shape) for key in PNL_KEYS}
+        if reused:
+            for key in PNL_KEYS:
+                block = (
+                    self.grid[key]
+                    .take(rows[old_rows], axis=0)
+                    .take(cols[old_cols], axis=1)
+                )
+                if reused == grid[key].size:
+                    grid[key] = block
+                else:
+                    grid[key][np.ix_(old_rows, old_cols)] = block
+        # whole rows for new vols, then only the new spots of the reused rows
+        if new_rows.any():
+            fresh = pnl_grid(entry_inputs, spot_range, vol_range[new_rows])
+            for key in PNL_KEYS:
+                grid[key][new_rows] = fresh[key]
+        if new_cols.any() and old_rows.any():
+            fresh = pnl_grid(entry_inputs, spot_range[new_cols], vol_range[old_rows])
+            for key in PNL_KEYS:
+                grid[key][np.ix_(old_rows, new_cols)] = fresh[key]
+
+        _reused.inc(reused)
+        _computed.inc(vol_range.size * spot_range.size - reused)
+
+        self.remember(entry_inputs, spot_range, vol_range, grid)
+        return grid
@@ -1,21 +1,20 @@
 """the UI for our app, uses streamlit, generates heat maps & runs migrations.."""
+import os
+import queue
 import sys
 from pathlib import Path
-from typing import Dict
+from typing import Tuple
 
-import matplotlib.pyplot as plt
 import numpy as np
-import pandas as pd
-import seaborn as sns
 import streamlit as st
 
 # Add parent directory to path to import modules
 sys.path.append(str(Path(__file__).parent.parent))
-from decorators import retry
-from db.migrate import run_migration
-from db.repositories.input_repo import InputRepository
-from db.repositories.output_repo import OutputRepository
-from main.logic import pnl, price_option
+import metrics
+from main.heatmap import render_pnl_heatmap
+from main.logic import INPUT_COLUMNS, enable_price_cache, price_option
+from main.scenario_grid import IncrementalPnlGrid, entry_key
+from main.writer import get_writer
 
 st.set_page_config(
     page_title="Black-Scholes PnL Calculator",
@@ -83,6 +82,9 @@ st.markdown(
 # Initialize database
 @st.cache_resource
 def init_database():
+    # plotting & db modules are imported where they are used to keep cold start short
+    from db.migrate import run_migration
+
     try:
         run_migration()
         return True
@@ -94,117 +96,80 @@ def init_database():
 init_database()
 
 
-# Helper Functions
-def generate_pnl_heatmap(
-    entry_inputs: Dict,
-    spot_range: np.ndarray,
-    vol_range: np.ndarray,
-    option_type: str = "call",
-):
-    """Generate PnL heatmap for call or put options"""
-    pnl_matrix = np.zeros((len(vol_range), len(spot_range)))
+# the pricing cache lives in main.logic, so it survives reruns of this script
+@st.cache_resource
+def init_price_cache():
+    return enable_price_cache(max_entries=10_000, max_bytes=16 * 1024 * 1024)
 
-    for i, vol in enumerate(vol_range):
-        for j, spot in enumerate(spot_range):
-            current_inputs = entry_inputs.copy()
-            current_inputs["StockPrice"] = spot
-            current_inputs["Volatility"] = vol
 
-            pnl_result = pnl(current_inputs, entry_inputs)
-            pnl_matrix[i, j] = pnl_result[f"{option_type}_pnl"]
+init_price_cache()
 
-    return pnl_matrix
 
+# METRICS_FILE / METRICS_INTERVAL turn on a periodic prometheus dump & log line
+@st.cache_resource
+def init_metrics_dump():
+    path = os.getenv("METRICS_FILE")
+    interval = os.getenv("METRICS_INTERVAL")
+    if not path and not interval:
+        return None
+    return metrics.registry.start_periodic_dump(float(interval or 60), path=path)
 
-def plot_pnl_heatmap(
-    pnl_matrix: np.ndarray, spot_range: np.ndarray, vol_range: np.ndarray, title: str
-):
-    """Create matplotlib heatmap"""
-    fig, ax = plt.subplots(figsize=(10, 8))
-
-    from matplotlib.colors import LinearSegmentedColormap
-
-    colors = [
-        "#eb3349",
-        "#f45c43",
-        "#ff9a76",
-        "#ffe5d9",
-        "#d4edda",
-        "#38ef7d",
-        "#11998e",
-    ]
-    n_bins = 100
-    cmap = LinearSegmentedColormap.from_list("trading", colors, N=n_bins)
-
-    sns.heatmap(
-        pnl_matrix,
-        xticklabels=np.round(spot_range, 2),
-        yticklabels=np.round(vol_range, 3),
-        annot=True,
-        fmt=".2f",
-        cmap=cmap,
-        center=0,
-        ax=ax,
-        cbar_kws={"label": "PnL ($)"},
-        linewidth=0.5,
-        linecolor="white",
-    )
 
-    ax.set_title(title, fontsize=16, fontweight="bold", pad=20)
-    ax.set_xlabel("Spot Price ($)", fontsize=12)
-    ax.set_ylabel("Volatility (σ)", fontsize=12)
+init_metrics_dump()
 
-    plt.xticks(rotation=45, ha="right")
-    plt.yticks(rotation=0)
+# pricing & db counters are logged per rerun as a delta from this snapshot
+rerun_metrics = metrics.registry.snapshot()
 
-    plt.tight_layout()
-    return fig
 
-@retry
-def save_calculation_to_db(
-    entry_inputs: Dict, spot_range: np.ndarray, vol_range: np.ndarray
+# Helper Functions
+@st.cache_data(max_entries=64, show_spinner=False)
+def cached_pnl_grid(
+    entry: Tuple[float, ...],
+    spot_axis: Tuple[float, float, int],
+    vol_axis: Tuple[float, float, int],
+    _grid: IncrementalPnlGrid,
 ):
-    """Save calculation inputs and outputs to database"""
-    try:
-        input_repo = InputRepository()
-        output_repo = OutputRepository()
-
-        calculation_id = input_repo.create_input(entry_inputs)
-
-        outputs = []
-        for vol_shock in vol_range:
-            for stock_shock in spot_range:
-                current_inputs = entry_inputs.copy()
-                current_inputs["StockPrice"] = stock_shock
-                current_inputs["Volatility"] = vol_shock
-
-                prices = price_option(current_inputs)
-
-                outputs.append(
-                    {
-                        "CalculationId": calculation_id,
-                        "VolatilityShock": vol_shock,
-                        "StockPriceShock": stock_shock,
-                        "OptionPrice": prices["call_price"],
-                        "IsCall": 1,
-                    }
-                )
-
-                outputs.append(
-                    {
-                        "CalculationId": calculation_id,
-                        "VolatilityShock": vol_shock,
-                        "StockPriceShock": stock_shock,
-                        "OptionPrice": prices["put_price"],
-                        "IsCall": 0,
-                    }
-                )
-
-        output_repo.create_outputs_batch(calculation_id, outputs)
-        return calculation_id
-    except Exception as e:
-        st.error(f"Failed to save to database: {e}")
-        return None
+    """keyed on the scalars the axes are built from, cheaper to hash than the arrays.
+    _grid (not hashed) is the session's previous grid, a miss only prices the cells
+    it doesn't already have"""
+    entry_inputs = dict(zip(INPUT_COLUMNS, entry))
+    return _grid.update(entry_inputs, np.linspace(*spot_axis), np.linspace(*vol_axis))
+
+
+# how often the save status polls its futures while a save is in flight
+SAVE_POLL_SECONDS = 0.5
+
+
+def show_save_status(writer):
+    """report finished saves without blocking the script. outcomes are kept in
+    session state so they survive the fragment's own reruns & the full rerun that
+    stops the polling once nothing is pending"""
+    pending_saves = st.session_state.setdefault("pending_saves", [])
+    save_results = st.session_state.setdefault("save_results", [])
+    polling = bool(pending_saves)
+    for future in list(pending_saves):
+        if not future.done():
+            continue
+        pending_saves.remove(future)
+        error = future.exception()
+        if error is not None:
+            save_results.append(("error", f"Failed to save to database: {error}"))
+        else:
+            saved = f"✅ Calculation saved! ID: {future.result()}"
+            save_results.append(("success", saved))
+
+    if polling and not pending_saves:
+        # run_every is fixed for this script run, a full rerun turns the polling off
+        st.session_state["save_results_kept"] = True
+        st.rerun()
+
+    for kind, message in save_results:
+        getattr(st, kind)(message)
+    if pending_saves:
+        st.info(
+            f"Saving {len(pending_saves)} calculation(s)... "
+            f"({writer.depth()} queued)"
+        )
 
 
 with st.sidebar:
@@ -318,9 +283,10 @@ with st.sidebar:
     heatmap_resolution = st.slider(
         "Heatmap Resolution",
         min_value=5,
-        max_value=20,
+        max_value=300,
         value=10,
-        help="Number of points in each dimension",
+        help="Number of points in each dimension, above 20 the heatmap is drawn as a "
+        "raster without per-cell values",
     )
 
     st.markdown("---")
@@ -409,7 +375,7 @@ try:
             f"{entry_prices['put_rho_1pct']:.6f}"
         ],
     }
-    st.table(pd.DataFrame(greeks_data))
+    st.table(greeks_data)
 
     st.markdown("---")
 
@@ -420,26 +386,32 @@ try:
     )
 
     # Generate ranges for heatmap
-    spot_range = np.linspace(spot_min, spot_max, heatmap_resolution)
-    vol_range = np.linspace(vol_min, vol_max, heatmap_resolution)
-
-    # Generate heatmaps
+    spot_axis = (spot_min, spot_max, heatmap_resolution)
+    vol_axis = (vol_min, vol_max, heatmap_resolution)
+    spot_range = np.linspace(*spot_axis)
+    vol_range = np.linspace(*vol_axis)
+
+    # Generate heatmaps, cached across reruns & sessions, and on a miss only the
+    # rows/columns this session hasn't priced yet are computed
+    incremental = st.session_state.setdefault("pnl_grid", IncrementalPnlGrid())
     with st.spinner("Generating PnL heatmaps..."):
-        call_pnl_matrix = generate_pnl_heatmap(
-            entry_inputs, spot_range, vol_range, "call"
-        )
-        put_pnl_matrix = generate_pnl_heatmap(
-            entry_inputs, spot_range, vol_range, "put"
+        pnl_matrices = cached_pnl_grid(
+            entry_key(entry_inputs), spot_axis, vol_axis, incremental
         )
+        incremental.remember(entry_inputs, spot_range, vol_range, pnl_matrices)
+        call_pnl_matrix = pnl_matrices["call_pnl"]
+        put_pnl_matrix = pnl_matrices["put_pnl"]
 
     col1, col2 = st.columns(2)
 
     with col1:
         st.subheader("CALL Option PnL")
-        fig_call = plot_pnl_heatmap(
-            call_pnl_matrix, spot_range, vol_range, "CALL PnL Heatmap"
+        st.image(
+            render_pnl_heatmap(
+                call_pnl_matrix, spot_range, vol_range, "CALL PnL Heatmap"
+            ),
+            use_container_width=True,
         )
-        st.pyplot(fig_call)
 
         st.markdown("**Statistics:**")
         st.write(f"Max PnL: ${call_pnl_matrix.max():.2f}")
@@ -448,10 +420,12 @@ try:
 
     with col2:
         st.subheader("PUT Option PnL")
-        fig_put = plot_pnl_heatmap(
-            put_pnl_matrix, spot_range, vol_range, "PUT PnL Heatmap"
+        st.image(
+            render_pnl_heatmap(
+                put_pnl_matrix, spot_range, vol_range, "PUT PnL Heatmap"
+            ),
+            use_container_width=True,
         )
-        st.pyplot(fig_put)
 
         st.markdown("**Statistics:**")
         st.write(f"Max PnL: ${put_pnl_matrix.max():.2f}")
@@ -459,20 +433,33 @@ try:
         st.write(f"Avg PnL: ${put_pnl_matrix.mean():.2f}")
 
     if save_to_db:
+        writer = get_writer()
+        pending_saves = st.session_state.setdefault("pending_saves", [])
+
         if st.button("💾 Save Calculation to Database"):
-            with st.spinner("Saving to database..."):
-                calc_id = save_calculation_to_db(entry_inputs, spot_range, vol_range)
-                if calc_id:
-                    st.success(f"✅ Calculation saved! ID: {calc_id}")
+            try:
+                pending_saves.append(
+                    writer.submit(entry_inputs, spot_range, vol_range)
+                )
+            except queue.Full:
+                st.error("Database writer is backed up, please retry shortly.")
+
+        # saves commit in the background, while one is in flight only this fragment
+        # reruns to poll it & the id shows as soon as it commits
+        if not st.session_state.pop("save_results_kept", False):
+            st.session_state["save_results"] = []
+        run_every = SAVE_POLL_SECONDS if pending_saves else None
+        st.fragment(run_every=run_every)(show_save_status)(writer)
 
     st.markdown("---")
     if st.checkbox("📜 Show Recent Calculations"):
         try:
+            from db.repositories.input_repo import InputRepository
+
             repo = InputRepository()
             recent = repo.list_recent_inputs(limit=5)
             if recent:
-                df_recent = pd.DataFrame(recent)
-                st.dataframe(df_recent, use_container_width=True)
+                st.dataframe(recent, use_container_width=True)
             else:
                 st.info("No recent calculations found.")
         except Exception as e:
@@ -481,3 +468,5 @@ try:
 except Exception as e:
     st.error(f"Calculation error: {e}")
     st.info("Please check your input parameters and try again.")
+
+metrics.registry.log_summary(since=rerun_metrics, prefix="rerun")
@@ -0,0 +1,225 @@
+"""a file with the background write-behind queue for saving calculations, the ui only
+enqueues and a worker thread prices & writes batches of calculations per transaction"""
+
+import atexit
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+from logger import get_logger
+from main.logic import price_options_batch
+from metrics import counter, histogram
+
+logger = get_logger(__file__)
+
+_saved = counter("calculation_writer_saved_total")
+_failed = counter("calculation_writer_failed_total")
+_batch_seconds = histogram("calculation_writer_batch_seconds")
+_queue_wait_seconds = histogram("calculation_writer_queue_wait_seconds")
+
+
+def save_calculation(
+    entry_inputs: Dict, spot_range: np.ndarray, vol_range: np.ndarray
+) -> int:
+    """price the spot x vol grid and store inputs & outputs, returns the calculation id"""
+    from db.config import output_storage
+    from db.repositories.grid_repo import OutputGridRepository
+    from db.repositories.input_repo import InputRepository
+    from db.repositories.output_repo import OutputRepository
+
+    calculation_id = InputRepository().create_input(entry_inputs)
+
+    spot_grid, vol_grid = np.meshgrid(spot_range, vol_range)
+    grid_inputs = dict(entry_inputs, StockPrice=spot_grid, Volatility=vol_grid)
+    prices = price_options_batch(grid_inputs, outputs="prices")
+
+    if output_storage in ("grid", "both"):
+        OutputGridRepository().save_grid(
+            calculation_id,
+            spot_range,
+            vol_range,
+            prices["call_price"],
+            prices["put_price"],
+        )
+
+    if output_storage in ("rows", "both"):
+        # call rows then put rows, one per (vol shock, spot shock, option type)
+        OutputRepository().create_outputs_bulk(
+            calculation_id,
+            np.tile(vol_grid.ravel(), 2),
+            np.tile(spot_grid.ravel(), 2),
+            np.concatenate([prices["call_price"].ravel(), prices["put_price"].ravel()]),
+            np.repeat([1, 0], vol_grid.size),
+        )
+    return calculation_id
+
+
+class _Job(NamedTuple):
+    entry_inputs: Dict
+    spot_range: np.ndarray
+    vol_range: np.ndarray
+    future: Future
+    enqueued_at: float
+
+
+_STOP = object()
+
+
+class CalculationWriter:
+    """bounded write-behind queue. submit() returns a Future resolving to the
+    calculation id once committed. the worker coalesces up to max_batch pending
+    calculations (waiting at most linger seconds for more) into one transaction,
+    submit blocks for up to submit_timeout when the queue is full (backpressure)
+    and then raises queue.Full"""
+
+    def __init__(
+        self,
+        max_queue: int = 64,
+        max_batch: int = 16,
+        linger: float = 0.05,
+        submit_timeout: Optional[float] = 5.0,
+    ):
+        self.max_batch = max_batch
+        self.linger = linger
+        self.submit_timeout = submit_timeout
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._closed = False
+        self._last_batch_seconds = 0.0
+        self._thread = threading.Thread(
+            target=self._run, name="calculation-writer", daemon=True
+        )
+        self._thread.start()
+
+    def submit(
+        self, entry_inputs: Dict, spot_range: np.ndarray, vol_range: np.ndarray
+    ) -> Future:
+        if self._closed:
+            raise RuntimeError("calculation writer is closed")
+
+        future = Future()
+        job = _Job(
+            dict(entry_inputs),
+            np.array(spot_range, dtype=np.float64),
+            np.array(vol_range, dtype=np.float64),
+            future,
+            time.perf_counter(),
+        )
+        self._queue.put(job, timeout=self.submit_timeout)
+        return future
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "queue_depth": self.depth(),
+            "saved": _saved.value,
+            "failed": _failed.value,
+            "last_batch_seconds": self._last_batch_seconds,
+            "batch_p99_seconds": _batch_seconds.quantile(0.99),
+        }
+
+    def close(self, timeout: Optional[float] = 30.0):
+        """flush everything already queued, then stop the worker"""
+        if self._closed:
+            return
+        self._closed = True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            # a full queue frees up as the worker drains it, never wait past timeout
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            logger.error("calculation writer queue still full after %ss", timeout)
+            return
+        remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+        self._thread.join(remaining)
+        if self._thread.is_alive():
+            logger.error("calculation writer did not flush within %ss", timeout)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            job = self._queue.get()
+            if job is _STOP:
+                break
+
+            batch = [job]
+            deadline = time.monotonic() + self.linger
+            while len(batch) < self.max_batch:
+                remaining = max(0.0, deadline - time.monotonic())
+                try:
+                    job = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if job is _STOP:
+                    stopping = True
+                    break
+                batch.append(job)
+
+            dequeued_at = time.perf_counter()
+            for job in batch:
+                _queue_wait_seconds.observe(dequeued_at - job.enqueued_at)
+            # a running future can no longer be cancelled, so from here on only the
+            # worker resolves it; ones the caller already cancelled are dropped
+            batch = [job for job in batch if job.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                self._write(batch)
+            except Exception as e:
+                # whatever went wrong, the worker must outlive it & no future may
+                # be left pending
+                logger.exception("calculation writer batch crashed")
+                for job in batch:
+                    if not job.future.done():
+                        job.future.set_exception(e)
+
+    def _write(self, batch: List[_Job]):
+        start = time.perf_counter()
+        try:
+            # imported here so a broken db setup fails the futures instead of
+            # killing the worker & leaving every pending future unresolved
+            from db.engine import database
+
+            with database.transaction():
+                ids = [
+                    save_calculation(job.entry_inputs, job.spot_range, job.vol_range)
+                    for job in batch
+                ]
+        except Exception as e:
+            logger.error("batch of %d calculations failed: %s", len(batch), e)
+            if len(batch) == 1:
+                _failed.inc()
+                batch[0].future.set_exception(e)
+            else:
+                # rolled back as a whole, retry one by one so one bad calculation
+                # does not sink the rest
+                for job in batch:
+                    self._write([job])
+            return
+
+        elapsed = time.perf_counter() - start
+        self._last_batch_seconds = elapsed
+        _batch_seconds.observe(elapsed)
+        _saved.inc(len(batch))
+        for job, calculation_id in zip(batch, ids):
+            job.future.set_result(calculation_id)
+
+
+_writer: Optional[CalculationWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_writer(**kwargs) -> CalculationWriter:
+    """process-wide writer, started on first use and flushed at interpreter exit"""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = CalculationWriter(**kwargs)
+            atexit.register(_writer.close)
+        return _writer
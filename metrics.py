@@ -0,0 +1,292 @@
+"""a file with an in-process metrics registry (counters, gauges & latency histograms) for the hot
+paths, aggregated in memory and dumped as prometheus text or a periodic log line"""
+
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from logger import get_logger
+
+logger = get_logger(__file__)
+
+# seconds, prometheus style upper bounds
+LATENCY_BUCKETS = (
+    1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4,
+    1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+# METRICS_ENABLED=0 turns every timer into a plain call
+_enabled = os.getenv("METRICS_ENABLED", "1") != "0"
+
+
+def set_enabled(enabled: bool):
+    global _enabled
+    _enabled = enabled
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...], extra: str = "") -> str:
+    parts = [f'{key}="{value}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, labels: Tuple[Tuple[str, str], ...]):
+        self.name = name
+        self.labels = labels
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: int = 1):
+        with self._lock:
+            self.value += amount
+
+    def reset(self):
+        with self._lock:
+            self.value = 0
+
+    def snapshot(self):
+        return self.value
+
+    def exposition(self):
+        return [f"{self.name}{_format_labels(self.labels)} {self.value}"]
+
+
+class Gauge(Counter):
+    """point-in-time value (pool occupancy, queue depth) that can go both ways"""
+
+    kind = "gauge"
+
+    def set(self, value):
+        with self._lock:
+            self.value = value
+
+    def dec(self, amount: int = 1):
+        self.inc(-amount)
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        labels: Tuple[Tuple[str, str], ...],
+        buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def reset(self):
+        with self._lock:
+            self.counts = [0] * (len(self.buckets) + 1)
+            self.count = 0
+            self.sum = 0.0
+
+    def snapshot(self):
+        with self._lock:
+            return self.count, self.sum, tuple(self.counts)
+
+    def quantile(self, q: float, counts=None) -> float:
+        """bucket upper bound holding the q-th observation, an over-estimate by at
+        most one bucket width"""
+        counts = self.counts if counts is None else counts
+        total = sum(counts)
+        if not total:
+            return 0.0
+        rank = q * total
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return float("inf")
+
+    def exposition(self):
+        count, total, counts = self.snapshot()
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            bucket_labels = _format_labels(self.labels, 'le="' + le + '"')
+            lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+        labels = _format_labels(self.labels)
+        lines.append(f"{self.name}_sum{labels} {total}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name: str, labels: Dict[str, str], **kwargs):
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(key)
+                if metric is None:
+                    metric = cls(name, key[1], **kwargs)
+                    self._metrics[key] = metric
+        if type(metric) is not cls:
+            raise ValueError(f"metric {name} already registered as a {metric.kind}")
+        return metric
+
+    def counter(self, name: str, **labels) -> Counter:
+        return self._get(Counter, name, labels)
+
+    def gauge(self, name: str, **labels) -> Gauge:
+        return self._get(Gauge, name, labels)
+
+    def histogram(
+        self, name: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS, **labels
+    ) -> Histogram:
+        return self._get(Histogram, name, labels, buckets=buckets)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        histogram = self.histogram(name, **labels)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if _enabled:
+                histogram.observe(time.perf_counter() - start)
+
+    def timed(self, name: str, **labels):
+        """decorator recording each call's wall time into a histogram, the histogram
+        is resolved once at decoration time so the per-call cost is two clock reads"""
+
+        def decorator(func):
+            histogram = self.histogram(name, **labels)
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                if not _enabled:
+                    return func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - start)
+
+            return wrapper
+
+        return decorator
+
+    def reset(self):
+        # metrics are zeroed in place, decorated functions keep their references
+        for metric in list(self._metrics.values()):
+            metric.reset()
+
+    def snapshot(self) -> Dict:
+        return {key: metric.snapshot() for key, metric in list(self._metrics.items())}
+
+    def to_prometheus(self) -> str:
+        lines = []
+        typed = set()
+        for (name, _), metric in sorted(self._metrics.items(), key=lambda item: item[0]):
+            if name not in typed:
+                lines.append(f"# TYPE {name} {metric.kind}")
+                typed.add(name)
+            lines.extend(metric.exposition())
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        # written to a temp file first so scrapers never read half a dump
+        path = Path(path)
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+        tmp_path.write_text(self.to_prometheus(), encoding="utf-8")
+        os.replace(tmp_path, path)
+
+    def summary_line(self, since: Optional[Dict] = None) -> str:
+        """one line with every metric that moved since the `since` snapshot"""
+        since = since or {}
+        parts = []
+        for key, metric in sorted(list(self._metrics.items()), key=lambda item: item[0]):
+            name = metric.name + _format_labels(metric.labels)
+            if isinstance(metric, Gauge):
+                if key not in since or metric.value != since[key]:
+                    parts.append(f"{name}={metric.value}")
+                continue
+            if isinstance(metric, Counter):
+                delta = metric.value - since.get(key, 0)
+                if delta:
+                    parts.append(f"{name}={delta}")
+                continue
+
+            count, total, counts = metric.snapshot()
+            prev_count, prev_total, prev_counts = since.get(
+                key, (0, 0.0, (0,) * len(counts))
+            )
+            delta_count = count - prev_count
+            if not delta_count:
+                continue
+            delta_counts = [now - before for now, before in zip(counts, prev_counts)]
+            parts.append(
+                f"{name} n={delta_count} "
+                f"mean={(total - prev_total) / delta_count * 1e3:.3f}ms "
+                f"p50<={metric.quantile(0.5, delta_counts) * 1e3:g}ms "
+                f"p99<={metric.quantile(0.99, delta_counts) * 1e3:g}ms"
+            )
+        return "; ".join(parts)
+
+    def log_summary(self, since: Optional[Dict] = None, prefix: str = "metrics"):
+        line = self.summary_line(since)
+        if line:
+            logger.info("%s: %s", prefix, line)
+
+    def start_periodic_dump(
+        self, interval: float = 60.0, path=None, log: bool = True
+    ) -> threading.Event:
+        """background thread writing the prometheus file and/or a log line every
+        interval seconds, set the returned event to stop it"""
+        stop = threading.Event()
+
+        def run():
+            previous = self.snapshot()
+            while not stop.wait(interval):
+                try:
+                    if path is not None:
+                        self.write_prometheus(path)
+                    if log:
+                        self.log_summary(previous)
+                        previous = self.snapshot()
+                except Exception as e:
+                    logger.error("metrics dump failed: %s", e)
+
+        threading.Thread(target=run, name="metrics-dump", daemon=True).start()
+        return stop
+
+
+# singleton shared by pricing, repositories & the db engine
+registry = MetricsRegistry()
+
+counter = registry.counter
+gauge = registry.gauge
+histogram = registry.histogram
+timer = registry.timer
+timed = registry.timed